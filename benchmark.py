@@ -0,0 +1,284 @@
+import importlib.util
+import contextlib
+import subprocess
+import argparse
+import tempfile
+import platform
+import shutil
+import random
+import json
+import math
+import sys
+import os
+
+from statistics import median, mean
+from time import perf_counter
+
+from instruments import PhaseStats
+
+try:
+    import resource
+except ImportError:#not unix
+    resource = None
+
+
+def load_module(path : str):
+    '''Loads module from file'''
+    spec = importlib.util.spec_from_file_location(os.path.basename(path), os.path.abspath(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def io_counters() -> dict[str, int]:
+    '''Returns read/write syscalls and bytes read by process, empty dict if /proc is unavailable. Stat calls are not counted by kernel'''
+    try:
+        with open('/proc/self/io', 'r') as file:
+            counters = dict(line.split(': ') for line in file.read().splitlines())
+    except OSError:
+        return {}
+    return {'syscalls' : int(counters['syscr']) + int(counters['syscw']), 'bytes_read' : int(counters['rchar'])}
+
+def percentile(values : list[float], p : float) -> float:
+    '''Returns nearest-rank percentile'''
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+def peak_rss_kb() -> int | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+def commit() -> str:
+    '''Returns current commit of repository, so results can be compared across commits'''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+class Fixture:
+    '''Synthetic watch tree: files of mixed sizes in deep dirs, big files, log folders and data.json which watches them'''
+    def __init__(self, root : str, files : int, depth : int, per_dir : int, big_files : int, big_size : int,
+                 log_dirs : int, log_files : int, rng : random.Random):
+        self.root : str = root
+        self.rng : random.Random = rng
+        self.valuable : dict[str, list] = {'dirs' : [], 'files' : [], 'logs' : [], 'trees' : []}
+        self.bytes : int = 0
+
+        started = perf_counter()
+        self.__make_files(files, depth, per_dir)
+        self.__make_big_files(big_files, big_size)
+        self.__make_logs(log_dirs, log_files)
+
+        self.honeypots_dir : str = os.path.join(root, 'honeypots')
+        os.makedirs(self.honeypots_dir)
+
+        self.config_path : str = os.path.join(root, 'data.json')
+        with open(self.config_path, 'w') as file:
+            json.dump({'valuable' : [self.valuable], 'bt_places' : [self.honeypots_dir]}, file)
+        self.build_time : float = perf_counter() - started
+
+    def __size(self) -> int:
+        '''Mostly small files, some medium ones'''
+        x = self.rng.random()
+        if x < 0.9:
+            return self.rng.randint(1, 16) * 1024
+        elif x < 0.99:
+            return self.rng.randint(64, 1024) * 1024
+        return self.rng.randint(1, 4) * 1048576
+
+    def __write(self, path : str, size : int) -> None:
+        chunk = self.rng.randbytes(min(size, 65536))
+        with open(path, 'wb') as file:
+            for _ in range(size // len(chunk)):
+                file.write(chunk)
+            file.write(chunk[:size % len(chunk)])
+        self.bytes += size
+
+    def __make_files(self, files : int, depth : int, per_dir : int) -> None:
+        '''Spreads files over leaf dirs of tree with given depth'''
+        leaves = max(1, math.ceil(files / per_dir))
+        fanout = max(2, math.ceil(leaves ** (1 / depth)))
+
+        for leaf in range(leaves):
+            parts, n = [], leaf
+            for _ in range(depth):
+                n, part = divmod(n, fanout)
+                parts.append(f'd{part}')
+            directory = os.path.join(self.root, 'tree', *parts)
+            os.makedirs(directory, exist_ok=True)
+            self.valuable['dirs'].append(directory)
+
+            for i in range(min(per_dir, files - leaf * per_dir)):
+                path = os.path.join(directory, f'f{i}.dat')
+                self.__write(path, self.__size())
+                self.valuable['files'].append(path)
+
+        self.valuable['trees'].append(os.path.join(self.root, 'tree', 'd0'))
+
+    def __make_big_files(self, amount : int, size : int) -> None:
+        self.big_files : int = amount
+        directory = os.path.join(self.root, 'big')
+        os.makedirs(directory)
+        for i in range(amount):
+            path = os.path.join(directory, f'hive{i}')
+            self.__write(path, size)
+            self.valuable['files'].append(path)
+
+    def __make_logs(self, dirs : int, files : int) -> None:
+        for i in range(dirs):
+            directory = os.path.join(self.root, 'logs', f'l{i}')
+            os.makedirs(directory)
+            for j in range(files):
+                with open(os.path.join(directory, f'{j}.log'), 'w') as file:
+                    file.write(''.join(f'{j} record {k}\n' for k in range(100)))
+            self.valuable['logs'].append(directory)
+
+    def mutate(self, fraction : float) -> None:
+        '''Appends, rewrites or touches fraction of files, appends logs records and creates/removes objects in dirs'''
+        files = self.valuable['files'][:len(self.valuable['files']) - self.big_files]
+        for path in self.rng.sample(files, max(1, int(len(files) * fraction))):
+            x = self.rng.random()
+            if x < 0.5:
+                with open(path, 'ab') as file:
+                    file.write(b'appended\n')
+            elif x < 0.75:
+                st = os.stat(path)
+                os.utime(path, ns=(st.st_atime_ns + 1000000000, st.st_mtime_ns))
+            else:
+                self.__write(path, os.path.getsize(path))
+
+        for directory in self.valuable['logs']:
+            with open(os.path.join(directory, f'{self.rng.randrange(100)}.log'), 'a') as file:
+                file.write('new record\n')
+
+        directory = self.rng.choice(self.valuable['dirs'])
+        path = os.path.join(directory, 'new.tmp')
+        if os.path.exists(path):
+            os.remove(path)
+        else:
+            open(path, 'w').close()
+
+
+def cycles(monitor, amount : int, mutate = None) -> dict:
+    '''Runs check cycles and returns their latency and io'''
+    latencies = []
+    io = {}
+    for _ in range(amount):
+        if mutate is not None:
+            mutate()
+
+        before = io_counters()#fixture writes are not counted
+        started = perf_counter()
+        monitor.check(1)
+        latencies.append(perf_counter() - started)
+        for k, v in io_counters().items():
+            io[k] = io.get(k, 0) + v - before[k]
+
+    out = {'cycles' : amount, 'p50_ms' : median(latencies) * 1000, 'p99_ms' : percentile(latencies, 99) * 1000,
+           'mean_ms' : mean(latencies) * 1000, 'max_ms' : max(latencies) * 1000}
+    for k, v in io.items():
+        out[f'{k}_per_cycle'] = v / amount
+    return out
+
+def timed(f, *args) -> dict:
+    '''Runs function once and returns its time and io'''
+    before = io_counters()
+    started = perf_counter()
+    f(*args)
+    out = {'time_s' : perf_counter() - started}
+    out.update({k : v - before[k] for k, v in io_counters().items()})
+    return out
+
+def run(args) -> dict:
+    mod = load_module(args.module)
+    rng = random.Random(args.seed)
+    root = tempfile.mkdtemp(prefix='mirage-bench-', dir=args.dir)
+    results = {}
+    monitor = honeypots = None
+
+    try:
+        fixture = Fixture(root, args.files, args.depth, args.per_dir, args.big_files, args.big_size_mb * 1048576,
+                          args.log_dirs, args.log_files, rng)
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+        with contextlib.redirect_stdout(sys.stderr):#module messages must not break JSON output
+            def start():
+                nonlocal monitor
+                monitor = mod.LocalMonitor(fixture.config_path, args.backend, hash_workers=args.hash_workers,
+                                           hash_algorithm=args.hash_algorithm, baseline_path=os.path.join(root, 'baseline.json'),
+                                           fd_scan_interval=0)
+            results['startup'] = timed(start)
+            phases = monitor.phases = PhaseStats() if args.phases else None
+            results['reset_primary_stats'] = timed(monitor.reset_primary_stats)
+            results['quiet'] = cycles(monitor, args.cycles)
+            results['mutating'] = cycles(monitor, args.cycles, lambda: fixture.mutate(args.mutate))
+
+            #fresh file, so no resumable hash state is used
+            path = os.path.join(root, 'big', 'hash_probe')
+            shutil.copyfile(fixture.valuable['files'][-1], path)
+            hashing = timed(monitor._LocalMonitor__calculate_hash, path)
+            hashing['mb_s'] = os.path.getsize(path) / 1048576 / hashing['time_s']
+            results['calculate_hash'] = hashing
+
+            honeypots = mod.LocalHoneypots(os.path.join(data_dir, 'pretty_objects.json'),
+                                           os.path.join(data_dir, 'pretty_contents.json'),
+                                           os.path.join(data_dir, 'gen_ex.txt'),
+                                           fixture.config_path, registry_path='', seed=str(args.seed), fd_scan_interval=0)
+            results['place_honeypots'] = timed(honeypots.place_honeypots, args.honeypots)
+            results['place_honeypots']['amount'] = args.honeypots
+            if phases is not None:
+                results['phases'] = phases.snapshot()
+
+    finally:
+        with contextlib.redirect_stdout(sys.stderr):#baseline is saved by monitor before fixture is removed
+            for obj in (monitor, honeypots):
+                if obj is not None:
+                    obj.close()
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        'commit' : commit(),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'params' : vars(args),
+        'fixture' : {'files' : len(fixture.valuable['files']), 'dirs' : len(fixture.valuable['dirs']),
+                     'logs' : len(fixture.valuable['logs']), 'bytes' : fixture.bytes, 'build_s' : fixture.build_time},
+        'results' : results,
+        'peak_rss_kb' : peak_rss_kb()
+    }
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mirage LocalMonitor and LocalHoneypots benchmark on synthetic watch tree')
+    parser.add_argument('--module', default='./modules/local_handler.py', help='path to module file')
+    parser.add_argument('--files', type=int, default=10000, help='amount of watched small and medium files')
+    parser.add_argument('--depth', type=int, default=6, help='depth of dirs tree')
+    parser.add_argument('--per-dir', type=int, default=100, help='files in one leaf dir')
+    parser.add_argument('--big-files', type=int, default=2, help='amount of big hive-like files')
+    parser.add_argument('--big-size-mb', type=int, default=64, help='size of big file')
+    parser.add_argument('--log-dirs', type=int, default=4, help='amount of watched log folders')
+    parser.add_argument('--log-files', type=int, default=100, help='files in one log folder')
+    parser.add_argument('--cycles', type=int, default=20, help='check cycles of each kind')
+    parser.add_argument('--mutate', type=float, default=0.01, help='fraction of files changed before mutating cycle')
+    parser.add_argument('--honeypots', type=int, default=1000, help='amount of placed honeypots')
+    parser.add_argument('--backend', default='poll', help='LocalMonitor backend')
+    parser.add_argument('--hash-workers', type=int, default=4)
+    parser.add_argument('--hash-algorithm', default='md5')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dir', default=None, help='where temp tree is made, system temp dir by default')
+    parser.add_argument('--phases', action='store_true', help='add monitor phases timings to results')
+    parser.add_argument('--keep', action='store_true', help='keep generated tree')
+    parser.add_argument('--output', default='', help='write JSON to file instead of stdout')
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    else:
+        print(report)
@@ -0,0 +1,136 @@
+import os
+import gzip
+import atexit
+import shutil
+import threading
+
+from json import dumps
+from datetime import datetime
+from queue import Queue, Empty, Full
+from time import monotonic
+
+
+class EventSink:
+    '''Abstract class for detections sinks. write() must not block check loop'''
+    def write(self, event : dict) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlSink(EventSink):
+    '''Writes events as JSON Lines from background thread. File is rotated by size or age, rotated files are compressed.
+    If writer falls behind and queue is full, new events are dropped and counted'''
+    def __init__(self, path : str = './data/events.jsonl', max_bytes : int = 64 * 1048576, max_age : float = 86400.0,
+                 backups : int = 10, queue_size : int = 100000, batch_size : int = 1000, flush_interval : float = 1.0):
+        self.path : str = path
+        self.max_bytes : int = max_bytes
+        self.max_age : float = max_age
+        self.backups : int = backups
+        self.batch_size : int = batch_size
+        self.flush_interval : float = flush_interval
+
+        self.queue : Queue = Queue(queue_size)
+        self.dropped : int = 0
+        self.written : int = 0
+
+        self.file = None
+        self.size : int = 0
+        self.opened : float = 0.0
+
+        self.running : bool = True
+        self.thread : threading.Thread = threading.Thread(target=self.__run, name='jsonl-sink', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)#queued events are written on exit
+
+    def write(self, event : dict) -> None:
+        '''Queues event for writing'''
+        try:
+            self.queue.put_nowait(event)
+        except Full:
+            self.dropped += 1
+
+    def depth(self) -> int:
+        '''Returns amount of events waiting for writing'''
+        return self.queue.qsize()
+
+    def close(self) -> None:
+        '''Writes queued events and stops writer'''
+        self.running = False
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def __run(self) -> None:
+        '''Writer loop, events are written in batches'''
+        while self.running or not self.queue.empty():
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except Empty:
+                self.__rotate_if_needed()
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            self.__write(''.join(dumps(event, default=str) + '\n' for event in batch))
+            self.written += len(batch)
+
+        if self.file is not None:
+            self.file.close()
+
+    def __write(self, data : str) -> None:
+        self.__rotate_if_needed()
+        try:
+            if self.file is None:
+                self.__open()
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
+        except OSError as e:
+            print(f'[@] {e} - events cannot be written')
+            self.file = None
+
+    def __open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+        self.opened = monotonic()
+
+    def __rotate_if_needed(self) -> None:
+        '''Rotates file when it is too big or too old'''
+        if self.file is None or not self.size:
+            return
+        if self.size < self.max_bytes and monotonic() - self.opened < self.max_age:
+            return
+
+        self.file.close()
+        self.file = None
+
+        rotated = f'{self.path}.{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}'
+        try:
+            os.replace(self.path, rotated)
+            with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        except OSError as e:
+            print(f'[@] {e} - events file cannot be rotated')
+            return
+
+        self.__prune()
+
+    def __prune(self) -> None:
+        '''Removes oldest compressed files over backups limit'''
+        directory, name = os.path.split(os.path.abspath(self.path))
+        rotated = sorted(x for x in os.listdir(directory) if x.startswith(name + '.') and x.endswith('.gz'))
+        for x in rotated[:max(0, len(rotated) - self.backups)]:
+            try:
+                os.remove(os.path.join(directory, x))
+            except OSError:
+                continue
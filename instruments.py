@@ -0,0 +1,121 @@
+import os
+import io
+import pstats
+import cProfile
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class PhaseStats:
+    '''Timers, counters and histograms of check pipeline phases. Every phase keeps calls, total and max time
+    and histogram with power of two buckets from 1 ms, so memory does not grow with calls'''
+    BOUNDS : tuple[float] = tuple(0.001 * 2 ** i for i in range(16))#seconds, last bucket is for longer phases
+
+    def __init__(self):
+        self.phases : dict[str, list] = {}#phase : [calls, total, max, buckets]
+        self.counters : dict[str, int] = {}
+
+    @contextmanager
+    def time(self, phase : str):
+        '''Times block as phase'''
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, perf_counter() - started)
+
+    def add(self, phase : str, elapsed : float) -> None:
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = [0, 0.0, 0.0, [0] * (len(self.BOUNDS) + 1)]
+
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+        stats[3][bisect_left(self.BOUNDS, elapsed)] += 1
+
+    def count(self, counter : str, n : int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def quantile(self, phase : str, q : float) -> float:
+        '''Returns upper bound of histogram bucket with q quantile, max time for last bucket'''
+        calls, _, longest, buckets = self.phases[phase]
+        rank = q * calls
+        seen = 0
+        for i, n in enumerate(buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(self.BOUNDS[i], longest) if i < len(self.BOUNDS) else longest
+        return longest
+
+    def snapshot(self) -> dict:
+        '''Returns phases and counters as plain dict'''
+        return {
+            'phases' : {phase : {'calls' : calls, 'total_s' : total, 'mean_ms' : total / calls * 1000,
+                                 'p50_ms' : self.quantile(phase, 0.5) * 1000, 'p99_ms' : self.quantile(phase, 0.99) * 1000,
+                                 'max_ms' : longest * 1000}
+                        for phase, (calls, total, longest, _) in self.phases.items()},
+            'counters' : dict(self.counters)
+        }
+
+    def report(self) -> str:
+        '''Returns phases table sorted by total time'''
+        snapshot = self.snapshot()
+        lines = [f'{"phase":<24}{"calls":>9}{"total s":>11}{"mean ms":>10}{"p50 ms":>10}{"p99 ms":>10}{"max ms":>10}']
+        for phase, x in sorted(snapshot['phases'].items(), key=lambda item: -item[1]['total_s']):
+            lines.append(f'{phase:<24}{x["calls"]:>9}{x["total_s"]:>11.3f}{x["mean_ms"]:>10.2f}'
+                         f'{x["p50_ms"]:>10.2f}{x["p99_ms"]:>10.2f}{x["max_ms"]:>10.2f}')
+        for counter, n in sorted(snapshot['counters'].items()):
+            lines.append(f'{counter:<24}{n:>9}')
+        return '\n'.join(lines)
+
+    def reset(self) -> None:
+        self.phases.clear()
+        self.counters.clear()
+
+
+class CycleProfiler:
+    '''Runs cProfile for requested amount of check cycles and dumps stats to file, which can be read by pstats or snakeviz.
+    Profiling can be requested again while monitor is running'''
+    def __init__(self, path : str = './data/profile.pstats', top : int = 25):
+        self.path : str = path
+        self.top : int = top
+        self.left : int = 0
+        self.cycles : int = 0
+        self.profiler : cProfile.Profile | None = None
+
+    def request(self, cycles : int) -> None:
+        '''Profiles next cycles, running profile is extended'''
+        self.left = max(self.left, cycles)
+
+    def start(self) -> None:
+        if not self.left:
+            return
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.cycles = 0
+        self.profiler.enable()
+
+    def stop(self) -> str | None:
+        '''Stops profiling of cycle. Returns top functions by cumulative time when last requested cycle is profiled'''
+        if self.profiler is None:
+            return None
+
+        self.profiler.disable()
+        self.cycles += 1
+        self.left -= 1
+        if self.left > 0:
+            return None
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.profiler.dump_stats(self.path)
+
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(self.top)
+        self.profiler = None
+        return out.getvalue()
@@ -1,16 +1,28 @@
 import importlib.util
+import configparser
+import argparse
 import inspect
+import ctypes
+import threading
+import signal
+import atexit
 import os
 
-from sys import exit, stdout, argv
+from sys import exit, stdout
 from datetime import datetime
-from time import sleep
+from collections import deque, OrderedDict
+from time import sleep, perf_counter, monotonic
+from contextlib import nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from event_sink import EventSink, JsonlSink
+from instruments import PhaseStats, CycleProfiler
 
 
 class Interface:
     '''Abstract class for beautiful interface'''
-    def __init__(self):
-        pass
+    def __init__(self, headless : bool = False):
+        self.headless : bool = headless
     
     def print_info(self, message : str) -> None:
         '''Prints info message'''
@@ -27,22 +39,33 @@ class Interface:
     def exit(self, message : str) -> None:
         '''Closes program with error message'''
         print(f'[@] {message}')
-        input('Press any key to continue')
+        if not self.headless:
+            input('Press any key to continue')
         exit()
 
 
 class ModuleHandler(Interface):
-    '''User Modules handler'''
-    def __init__(self, mod_path : str, module : str):
-        super().__init__()
+    '''User Modules handler. Phases of loading, starting and checking are timed if phases are given'''
+    def __init__(self, mod_path : str, module : str, headless : bool = False, phases : PhaseStats | None = None):
+        super().__init__(headless)
 
+        self.phases : PhaseStats | None = phases
         self.module_path : str = mod_path
-        self.module_object = self.load_module(module)
+        with self.timed('load_module'):
+            self.module_object = self.load_module(module)
         self.os_name : str = os.name
 
         self.monitor = None
         self.honeypots = None
         
+    def timed(self, phase : str):
+        '''Times phase if phases are collected'''
+        return nullcontext() if self.phases is None else self.phases.time(phase)
+
+    def attach_phases(self, obj) -> None:
+        '''Passes phases to Monitor or Honeypots which have optional phases attribute'''
+        if self.phases is not None and hasattr(obj, 'phases'):
+            obj.phases = self.phases
 
     def load_module(self, module : str):
         '''Loads module by its name'''
@@ -114,6 +137,24 @@ class ModuleHandler(Interface):
             return -1
 
 
+    def config_params(self, target_class, values : dict) -> list:
+        '''Sets module params from params file section. Parameters that are not set keep default values'''
+        sig = inspect.signature(target_class.__init__)
+
+        new_values = []
+        for param in sig.parameters.values():
+            if param.name == 'self' or param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+                continue
+
+            if param.name in values:
+                new_values.append(values[param.name])
+            elif param.default != inspect.Parameter.empty:
+                new_values.append(param.default)
+            else:
+                self.exit(f'Parameter {param.name} of {target_class.__name__} is not set, exit')
+
+        return new_values
+
     def check_module(self) -> list[tuple]:
         '''Checks if module has Monitor and Honeypots classes. Monitor class is necessary.'''
         self.print_action(f'Checking module {self.module_object.__name__}...')
@@ -178,47 +219,334 @@ class ModuleHandler(Interface):
         
         return honeypots
 
-    def start_mon(self, mon : str) -> None:
-        '''Creates Monitor class example'''
+    def start_mon(self, mon : str, params : list = None) -> None:
+        '''Creates Monitor class example. Parameters are asked if they are not given'''
         try:
             self.print_action('Starting Monitor...')
 
-            tmp = self.select_params(getattr(self.module_object, mon))
-            while tmp == -1:
+            tmp = params
+            while tmp is None or tmp == -1:
                 tmp = self.select_params(getattr(self.module_object, mon))
             
-            self.monitor = getattr(self.module_object, mon)(*tmp)
+            with self.timed('start_monitor'):
+                self.monitor = getattr(self.module_object, mon)(*tmp)
+            self.attach_phases(self.monitor)
 
             self.print_info('Monitor started\n')
         except Exception as e:
             self.exit(f'{e} - error occured while monitor starting, exit')
     
-    def start_hon(self, hon : str, amount : int) -> None:
-        '''Creates Honeypots class example'''
+    def start_hon(self, hon : str, amount : int, params : list = None) -> None:
+        '''Creates Honeypots class example. Parameters are asked if they are not given'''
         try:
             self.print_action('Starting Honeypots...')
 
-            tmp = self.select_params(getattr(self.module_object, hon))
-            while tmp == -1:
+            tmp = params
+            while tmp is None or tmp == -1:
                 tmp = self.select_params(getattr(self.module_object, hon))
             self.honeypots = getattr(self.module_object, hon)(*tmp)
+            self.attach_phases(self.honeypots)
 
-            self.honeypots.place_honeypots(self.monitor, amount)
+            with self.timed('place_honeypots'):#monitor is passed only to honeypots which use it
+                if 'monitor' in inspect.signature(self.honeypots.place_honeypots).parameters:
+                    self.honeypots.place_honeypots(self.monitor, amount)
+                else:
+                    self.honeypots.place_honeypots(amount)
             self.print_info('Honeypots started\n')
         except Exception as e:
             self.exit(f'{e} - error occured while honeypots starting, exit')
 
 
+class Scheduler:
+    '''Fixed-rate scheduler on monotonic clock. Runs are planned on interval grid, so they do not drift with check time.
+    Overrun policy: skip - missed runs are dropped, catch-up - missed runs are done one by one without waiting'''
+    def __init__(self, interval : float, overrun : str = 'skip'):
+        if overrun not in ('skip', 'catch-up'):
+            raise ValueError(f'unknown overrun policy {overrun}')
+
+        self.interval : float = interval
+        self.overrun : str = overrun
+        self.next_run : float = monotonic()
+        self.last_run : float | None = None
+        self.missed : int = 0#runs missed by last overrun
+        self.overruns : int = 0
+
+    def start(self) -> float:
+        '''Marks run start and returns real time passed since previous run. Early runs(e.g. woken by events) do not move the grid'''
+        now = monotonic()
+        elapsed = now - self.last_run if self.last_run is not None else self.interval
+        self.last_run = now
+        self.missed = 0
+
+        if now >= self.next_run:
+            self.next_run += self.interval
+            if self.next_run <= now:
+                self.missed = int((now - self.next_run) // self.interval) + 1
+                self.overruns += 1
+                if self.overrun == 'skip':
+                    self.next_run += self.missed * self.interval
+
+        return elapsed
+
+    def remaining(self) -> float:
+        '''Returns time left before next run'''
+        return max(0.0, self.next_run - monotonic())
+
+
+class SuspectTracker:
+    '''Merges repeated hits of suspect into one event. Suspect is new on first hit, ongoing while hits repeat within window
+    and resolved when window passes without hits. Least recently hit suspects are resolved early if max_size is reached'''
+    def __init__(self, window : float = 60.0, max_size : int = 100000):
+        self.window : float = window
+        self.max_size : int = max_size
+        self.suspects : OrderedDict = OrderedDict()#path : record, ordered by last hit
+        self.buckets : deque = deque(maxlen=60)#[second, events, hits] of last minute
+
+    def hit(self, path : str, info : dict) -> tuple[str, dict]:
+        '''Registers hit of suspect and returns its state and record. Non-empty info values update ongoing record'''
+        now = monotonic()
+        record = self.suspects.get(path)
+        self.__count(now, record is None)
+
+        if record is not None:
+            record['count'] += 1
+            record['seen'] = now
+            record['last'] = datetime.now()
+            record.update((k, v) for k, v in info.items() if v)
+            self.suspects.move_to_end(path)
+            return 'ongoing', record
+
+        record = {'first' : datetime.now(), 'seen' : now, 'count' : 1, **info}
+        record['last'] = record['first']
+        if self.window > 0:
+            self.suspects[path] = record
+        return 'new', record
+
+    def expire(self) -> list[tuple[str, dict]]:
+        '''Returns resolved suspects and forgets them'''
+        now = monotonic()
+        out = []
+        while self.suspects:
+            path, record = next(iter(self.suspects.items()))
+            if now - record['seen'] < self.window and len(self.suspects) <= self.max_size:
+                break
+            self.suspects.popitem(last=False)
+            out.append((path, record))
+        return out
+
+    def __count(self, now : float, new : bool) -> None:
+        second = int(now)
+        if not self.buckets or self.buckets[-1][0] != second:
+            self.buckets.append([second, 0, 0])
+        self.buckets[-1][1] += new
+        self.buckets[-1][2] += 1
+
+    def rates(self) -> tuple[int, int]:
+        '''Returns amount of events and raw hits for last minute'''
+        now = monotonic()
+        recent = [x for x in self.buckets if now - x[0] < 60]
+        return sum(x[1] for x in recent), sum(x[2] for x in recent)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    '''Answers scrapes with last published metrics'''
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class MetricsServer:
+    '''Serves metrics in Prometheus text format from background thread. Check loop only counts and swaps published snapshot,
+    scrapes render it on their own thread, so they never wait for check and check never waits for them.
+    Monitor and Honeypots may have optional metrics() method, which returns {name : value or {category : value}}'''
+    BUCKETS : tuple[float] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)#seconds
+
+    def __init__(self, host : str = '127.0.0.1', port : int = 9464):
+        self.cycle_buckets : list[int] = [0] * len(self.BUCKETS)
+        self.cycle_sum : float = 0.0
+        self.cycles : int = 0
+        self.suspects : dict[str, int] = {}
+        self.honeypot_hits : int = 0
+        self.snapshot : dict = {}
+
+        self.server : ThreadingHTTPServer = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self
+        self.thread : threading.Thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+
+    def observe_cycle(self, duration : float, suspects_map : dict[str, list]) -> None:
+        for i, bound in enumerate(self.BUCKETS):
+            if duration <= bound:
+                self.cycle_buckets[i] += 1
+        self.cycle_sum += duration
+        self.cycles += 1
+
+        for category, suspects in suspects_map.items():
+            self.suspects[category] = self.suspects.get(category, 0) + len(suspects)
+
+    def publish(self, monitor, honeypots, sinks : list[EventSink], overruns : int) -> None:
+        '''Takes snapshot of counters for scrapes, snapshot is replaced as a whole'''
+        self.snapshot = {
+            'cycle' : (list(self.cycle_buckets), self.cycle_sum, self.cycles),
+            'overruns' : overruns,
+            'suspects' : dict(self.suspects),
+            'honeypot_hits' : self.honeypot_hits,
+            'queue_depth' : sum(sink.depth() for sink in sinks if hasattr(sink, 'depth')),
+            'dropped' : sum(getattr(sink, 'dropped', 0) for sink in sinks),
+            'monitor' : monitor.metrics() if hasattr(monitor, 'metrics') else {},
+            'honeypots' : honeypots.metrics() if honeypots is not None and hasattr(honeypots, 'metrics') else {}
+        }
+
+    def __escape(self, value : str) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def __metric(self, lines : list[str], name : str, value, kind : str, description : str, label : str = 'category') -> None:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if isinstance(value, dict):
+            lines.extend(f'{name}{{{label}="{self.__escape(k)}"}} {v}' for k, v in value.items())
+        else:
+            lines.append(f'{name} {value}')
+
+    def render(self) -> str:
+        snapshot = self.snapshot
+        if not snapshot:
+            return ''
+
+        lines = []
+        buckets, total, count = snapshot['cycle']
+        lines.append('# HELP mirage_cycle_duration_seconds Check cycle duration')
+        lines.append('# TYPE mirage_cycle_duration_seconds histogram')
+        lines.extend(f'mirage_cycle_duration_seconds_bucket{{le="{bound}"}} {n}' for bound, n in zip(self.BUCKETS, buckets))
+        lines.append(f'mirage_cycle_duration_seconds_bucket{{le="+Inf"}} {count}')
+        lines.append(f'mirage_cycle_duration_seconds_sum {total}')
+        lines.append(f'mirage_cycle_duration_seconds_count {count}')
+
+        self.__metric(lines, 'mirage_overruns_total', snapshot['overruns'], 'counter', 'Check overruns')
+        self.__metric(lines, 'mirage_suspects_total', snapshot['suspects'], 'counter', 'Suspects found by checks')
+        self.__metric(lines, 'mirage_honeypot_hits_total', snapshot['honeypot_hits'], 'counter', 'New detections of honeypots')
+        self.__metric(lines, 'mirage_event_queue_depth', snapshot['queue_depth'], 'gauge', 'Events waiting for writing')
+        self.__metric(lines, 'mirage_events_dropped_total', snapshot['dropped'], 'counter', 'Events dropped by full queue')
+
+        for prefix in ('monitor', 'honeypots'):
+            for name, value in snapshot[prefix].items():
+                kind = 'counter' if name.endswith('_total') else 'gauge'
+                self.__metric(lines, f'mirage_{prefix}_{name}', value, kind, f'{prefix.capitalize()} {name.replace("_", " ")}')
+
+        return '\n'.join(lines) + '\n'
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TableRenderer:
+    '''Incremental terminal table. Keeps bounded rows history, older rows are spilled to history file'''
+    def __init__(self, header : list[str], max_rows : int = 1000, history_path : str = './data/history.log'):
+        self.header : list[str] = header
+        self.rows : deque = deque(maxlen=max_rows)
+        self.widths : list[int] = [len(x) for x in header]
+        self.history_path : str = history_path
+        self.history = None
+
+        self.pending : list[list[str]] = []#rows which are not painted yet
+        self.full_redraw : bool = True
+
+        if os.name == 'nt':#enable ANSI sequences in Windows console
+            kernel32 = ctypes.windll.kernel32
+            handle = kernel32.GetStdHandle(-11)
+            mode = ctypes.c_uint32()
+            if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+                kernel32.SetConsoleMode(handle, mode.value | 0x4)
+
+    def add(self, rows : list[list]) -> None:
+        '''Adds rows to table, widths are updated on the fly'''
+        for row in rows:
+            row = [str(x) for x in row]
+            if len(self.rows) == self.rows.maxlen:
+                self.__spill(self.rows[0])
+
+            self.rows.append(row)
+            self.pending.append(row)
+
+            for i, x in enumerate(row):
+                if len(x) > self.widths[i]:
+                    self.widths[i] = len(x)
+                    self.full_redraw = True
+
+    def __spill(self, row : list[str]) -> None:
+        '''Writes row that leaves history to file'''
+        try:
+            if self.history is None:
+                self.history = open(self.history_path, 'a')
+            self.history.write('\t'.join(row) + '\n')
+        except OSError:
+            pass
+
+    def __border(self, left : str, middle : str, right : str) -> str:
+        return left + middle.join("─" * (x + 2) for x in self.widths) + right + '\n'
+
+    def __line(self, row : list[str]) -> str:
+        return "│" + "│".join(f" {x.ljust(w)} " for x, w in zip(row, self.widths)) + "│" + '\n'
+
+    def render(self) -> None:
+        '''Paints new rows only. Whole table is painted again only if columns became wider'''
+        if self.full_redraw:
+            out = ['\033[H\033[2J', self.__border("┌", "┬", "┐"), self.__line(self.header), self.__border("├", "┼", "┤")]
+            out.extend(self.__line(row) for row in self.rows)
+            self.full_redraw = False
+
+        elif self.pending:
+            out = ['\033[1A\r']#move up to bottom border and overwrite it
+            out.extend(self.__line(row) for row in self.pending)
+
+        else:
+            return
+
+        out.append(self.__border("└", "┴", "┘"))
+        self.pending = []
+
+        stdout.write(''.join(out))
+        stdout.flush()
+        if self.history is not None:
+            self.history.flush()
+
+
 class IOHandler(Interface):
     '''Interface for event monitoring.'''
     def __init__(self, module_handler : ModuleHandler):
-        super().__init__()
+        super().__init__(module_handler.headless)
 
         self.module_handler : ModuleHandler = module_handler
 
-        self.header : list[str] = ['Date', 'Path', 'IsHoneypot']
+        self.header : list[str] = ['Date', 'Path', 'IsHoneypot', 'Process', 'State', 'Hits']
         self.delay : int = 0
+        self.overrun : str = 'skip'
+        self.tripwire_delay : float = 0.5
         self.amount : int = 0
+        self.history_rows : int = 1000
+        self.history_path : str = './data/history.log'
+        self.events_path : str = './data/events.jsonl'
+        self.events_max_mb : int = 64
+        self.sinks : list[EventSink] = []
+        self.dedup_window : float = 60.0
+        self.dedup_max : int = 100000
+        self.tracker : SuspectTracker | None = None
+        self.profiler : CycleProfiler = CycleProfiler()
+        self.profile_cycles : int = 10#cycles profiled on SIGUSR1
+        self.metrics : MetricsServer | None = None
 
     def __ans_check(self, f, n : int):
         '''Cycle for correct answer'''
@@ -227,12 +555,108 @@ class IOHandler(Interface):
             tmp = f()
         return tmp
 
-    def __extract_suspects(self, suspects_map : dict[str, list]) -> list:
-        '''Extracts suspects from suspects map to list'''
-        res = []
-        for k in suspects_map.keys():
-            res.extend(suspects_map[k])
-        return res
+    def __detections(self, suspects_map : dict[str, list]) -> list[tuple]:
+        '''Returns (date, path, is honeypot, process, state, hits) of new and resolved suspects and passes them to sinks as events.
+        Repeated hits of ongoing suspects are merged by tracker. Old and new stats are taken from optional details() method of Monitor'''
+        monitor, honeypots = self.module_handler.monitor, self.module_handler.honeypots
+        details = monitor.details() if self.sinks and hasattr(monitor, 'details') else {}
+        processes = self.__processes()
+        if self.tracker is None:
+            self.tracker = SuspectTracker(self.dedup_window, self.dedup_max)
+
+        #single hit suspect is fully described by its new event
+        out = [self.__emit(path, record, 'resolved') for path, record in self.tracker.expire() if record['count'] > 1]
+        for category, suspects in suspects_map.items():
+            for path in suspects:
+                state, record = self.tracker.hit(path, {'category' : category, 'process' : processes.get(path, ''),
+                                                        'details' : details.get(path, {})})
+                if state == 'new':
+                    #tripwire hit is honeypot even if it was deleted or moved
+                    record['is_honeypot'] = category == 'honeypots' or (honeypots.is_honeypot(path) if honeypots else False)
+                    out.append(self.__emit(path, record, state))
+                    if self.metrics is not None and record['is_honeypot']:
+                        self.metrics.honeypot_hits += 1
+        return out
+
+    def __cycle(self, scheduler : Scheduler) -> list[tuple]:
+        '''Runs check and returns detections. Cycle is profiled if profiling was requested'''
+        self.profiler.start()
+        started = perf_counter()
+        with self.module_handler.timed('check'):
+            suspects_map = self.module_handler.monitor.check(scheduler.start())
+        with self.module_handler.timed('detections'):
+            out = self.__detections(suspects_map)
+        for event in self.log_events():
+            for sink in self.sinks:
+                sink.write(event)
+
+        if self.metrics is not None:
+            self.metrics.observe_cycle(perf_counter() - started, suspects_map)
+            self.publish_metrics(scheduler)
+
+        if self.module_handler.phases is not None:
+            for category, suspects in suspects_map.items():
+                self.module_handler.phases.count(f'suspects_{category}', len(suspects))
+
+        top = self.profiler.stop()
+        if top is not None:
+            self.print_info(f'Profile of {self.profiler.cycles} cycles saved to {self.profiler.path}')
+            if self.headless:
+                print(top, flush=True)
+        return out
+
+    def publish_metrics(self, scheduler : Scheduler) -> None:
+        if self.metrics is not None:
+            self.metrics.publish(self.module_handler.monitor, self.module_handler.honeypots, self.sinks, scheduler.overruns)
+
+    def handle_signals(self) -> None:
+        '''Running monitor profiles next cycles on SIGUSR1 and prints phases report on SIGUSR2'''
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+
+        signal.signal(signal.SIGUSR1, lambda *_: self.profiler.request(self.profile_cycles))
+        if self.module_handler.phases is not None:
+            signal.signal(signal.SIGUSR2, lambda *_: print(self.module_handler.phases.report(), flush=True))
+
+    def __emit(self, path : str, record : dict, state : str) -> tuple:
+        '''Passes suspect event to sinks and returns its table row'''
+        date = record['first'] if state == 'new' else record['last']
+        if self.sinks:
+            event = {'time' : date.isoformat(), 'path' : path, 'category' : record['category'], 'state' : state,
+                     'is_honeypot' : record['is_honeypot'], 'process' : record['process'], 'count' : record['count'],
+                     'first_seen' : record['first'].isoformat(), 'last_seen' : record['last'].isoformat()}
+            event.update(record['details'])
+            for sink in self.sinks:
+                sink.write(event)
+
+        return (date, path, record['is_honeypot'], record['process'], state, record['count'])
+
+    def log_events(self) -> list[dict]:
+        '''Returns records appended to valuable logs as events. They are taken from optional log_records() method of Monitor
+        and are drained every cycle, even without sinks'''
+        monitor = self.module_handler.monitor
+        if not hasattr(monitor, 'log_records'):
+            return []
+        date = datetime.now().isoformat()
+        return [{'time' : date, 'path' : path, 'category' : 'logs', 'state' : 'record',
+                 'record' : record.decode('utf-8', 'backslashreplace')} for path, record in monitor.log_records()]
+
+    def open_sinks(self) -> None:
+        '''Opens JSON Lines events sink if events path is set'''
+        if self.events_path and not self.sinks:
+            self.sinks.append(JsonlSink(self.events_path, self.events_max_mb * 1048576))
+
+
+    def __processes(self) -> dict[str, str]:
+        '''Collects processes which hold suspects open. They are taken from optional open_handles() methods of Monitor and Honeypots'''
+        out = {}
+        for obj in (self.module_handler.monitor, self.module_handler.honeypots):
+            if obj is None or not hasattr(obj, 'open_handles'):
+                continue
+            for path, pid, user, cmdline in obj.open_handles():
+                out.setdefault(path, []).append(f'{pid} {user} {cmdline[:60]}')
+
+        return {path : ', '.join(processes) for path, processes in out.items()}
 
 
     def select_classes(self, classes : list[str]) -> tuple[str]:
@@ -287,28 +711,6 @@ class IOHandler(Interface):
             return -1
 
 
-    def clean_screen(self) -> None:
-        if self.module_handler.os_name == 'nt':
-            os.system('cls')
-        else:
-            os.system('clear')
-
-    def draw_table(self, data : list[list[str]]) -> None:
-        if not data: return
-        
-        w = [max(len(str(r[i])) for r in data) for i in range(len(data[0]))]
-        
-        stdout.write("┌" + "┬".join("─" * (x + 2) for x in w) + "┐" + '\n')
-        
-        for row in data:
-            line = "│".join(f" {str(x).ljust(w)} " for x, w in zip(row, w))
-            stdout.write(f"│{line}│" + '\n')
-            if row == data[0]:
-                stdout.write("├" + "┼".join("─" * (x + 2) for x in w) + "┤" + '\n')
-        
-        stdout.write("└" + "┴".join("─" * (x + 2) for x in w) + "┘" + '\n')
-        stdout.flush()
-
     def start_loop(self, selected_classes : tuple[str]) -> None:
         self.module_handler.start_mon(selected_classes[0])
         if selected_classes[1]:
@@ -316,24 +718,81 @@ class IOHandler(Interface):
         
         self.delay = self.__ans_check(self.select_delay, -1)
 
-        self.clean_screen()
         self.main_loop()
 
+    def wait(self, timeout : float | None = None) -> bool:
+        '''Waits for next check. Monitor may wake up earlier if it has its own wait() method, then True is returned'''
+        timeout = self.delay if timeout is None else timeout
+        if hasattr(self.module_handler.monitor, 'wait'):
+            return bool(self.module_handler.monitor.wait(timeout))
+
+        sleep(timeout)
+        return False
+
+    def has_tripwire(self) -> bool:
+        '''Checks if Honeypots class has optional tripwire() method'''
+        return self.module_handler.honeypots is not None and hasattr(self.module_handler.honeypots, 'tripwire')
+
+    def watch_traps(self, timeout : float):
+        '''Waits for next check and yields touched honeypots every tripwire delay'''
+        if not self.has_tripwire():
+            self.wait(timeout)
+            return
+
+        end = monotonic() + timeout
+        while True:
+            left = end - monotonic()
+            if left <= 0 or self.wait(min(left, self.tripwire_delay)):
+                return
+
+            with self.module_handler.timed('tripwire'):
+                hits = self.module_handler.honeypots.tripwire()
+            if hits:
+                yield hits
+
     def main_loop(self) -> None:
-        all_checks = [self.header]
+        renderer = TableRenderer(self.header, self.history_rows, self.history_path)
+        scheduler = Scheduler(self.delay, self.overrun)
+        self.open_sinks()
+        self.handle_signals()
         run = True
 
         while run:
-            check = self.__extract_suspects(self.module_handler.monitor.check(self.delay))
-            for path in check:
-                pack = [str(datetime.now()), path, self.module_handler.honeypots.is_honeypot(path) 
-                                                            if self.module_handler.honeypots else False]
-                all_checks.append(pack)
-            
-            self.draw_table(all_checks)
-            sleep(self.delay)
+            check = self.__cycle(scheduler)
+            with self.module_handler.timed('render'):
+                renderer.add(check)
+                renderer.render()
+
+            for hits in self.watch_traps(scheduler.remaining()):
+                renderer.add(self.__detections({'honeypots' : hits}))
+                self.publish_metrics(scheduler)
+                with self.module_handler.timed('render'):
+                    renderer.render()
+
+    def headless_loop(self) -> None:
+        '''Prints detections as plain lines without terminal table'''
+        scheduler = Scheduler(self.delay, self.overrun)
+        self.open_sinks()
+        self.handle_signals()
+        next_rates = monotonic() + 60
+        run = True
 
-            self.clean_screen()
+        while run:
+            check = self.__cycle(scheduler)
+            if scheduler.missed:
+                self.print_info(f'Check overrun, {scheduler.missed} checks {"skipped" if self.overrun == "skip" else "delayed"}')
+            if monotonic() >= next_rates:
+                events, hits = self.tracker.rates()
+                self.print_info(f'Last minute: {events} events, {hits} hits')
+                next_rates += 60
+
+            for detection in check:
+                print('\t'.join(map(str, detection)), flush=True)
+
+            for hits in self.watch_traps(scheduler.remaining()):
+                for detection in self.__detections({'honeypots' : hits}):
+                    print('\t'.join(map(str, detection)), flush=True)
+                self.publish_metrics(scheduler)
 
     def main(self) -> None:
         available_classes = self.module_handler.check_module()
@@ -341,14 +800,133 @@ class IOHandler(Interface):
 
         self.start_loop(selected_classes)
 
+    def main_headless(self, params : configparser.ConfigParser, started : float) -> None:
+        '''Starts monitoring without prompts and prints detections'''
+        self.start_headless(params)
+        self.print_info(f'Monitoring started in {perf_counter() - started:.3f} s')
+        self.headless_loop()
 
+    def start_headless(self, params : configparser.ConfigParser) -> None:
+        '''Starts Monitor and Honeypots without prompts. Classes parameters, amount and delay are taken from params'''
+        mon, hon = self.module_handler.check_module()
 
-if __name__ == '__main__':
-    if len(argv) != 3:
-        print('[@] Incorrect arguments, exit')
+        settings = params['module'] if params.has_section('module') else {}
+        mon = settings.get('monitor', mon)
+        hon = settings.get('honeypots', hon)
+        try:
+            self.amount = int(settings.get('amount', 0))
+            self.delay = int(settings.get('delay', 1))
+        except ValueError:
+            self.exit('Amount and delay must be numbers, exit')
+
+        self.overrun = settings.get('overrun', self.overrun)
+        if self.overrun not in ('skip', 'catch-up'):
+            self.exit('Overrun must be skip or catch-up, exit')
+        try:
+            self.tripwire_delay = float(settings.get('tripwire_delay', self.tripwire_delay))
+            self.events_max_mb = int(settings.get('events_max_mb', self.events_max_mb))
+        except ValueError:
+            self.exit('Tripwire delay and events size must be numbers, exit')
+        self.events_path = settings.get('events_path', self.events_path)
+        try:
+            self.dedup_window = float(settings.get('dedup_window', self.dedup_window))
+            self.dedup_max = int(settings.get('dedup_max', self.dedup_max))
+        except ValueError:
+            self.exit('Dedup window and size must be numbers, exit')
+
+        if self.delay <= 0 or self.amount < 0:
+            self.exit('Delay must be bigger than 0 and amount must not be negative, exit')
+        for name in (mon, hon):
+            if name and not hasattr(self.module_handler.module_object, name):
+                self.exit(f'No {name} class in module, exit')
+
+        section = lambda name: dict(params[name]) if params.has_section(name) else {}
+        module_object = self.module_handler.module_object
+
+        self.module_handler.start_mon(mon, self.module_handler.config_params(getattr(module_object, mon), section(mon)))
+        if hon and self.amount:
+            self.module_handler.start_hon(hon, self.amount,
+                                          self.module_handler.config_params(getattr(module_object, hon), section(hon)))
+
+
+def read_params(path : str, delay : int = None, amount : int = None, overrides : list[str] = []) -> configparser.ConfigParser:
+    '''Reads headless params file and applies Class.param=value overrides'''
+    params = configparser.ConfigParser()
+    params.optionxform = str#keep parameters names as they are
+
+    if path and not params.read(path):
+        print(f'[@] Params file {path} cannot be read, exit')
         exit()
 
-    mod_path, module = argv[1:]
-    mh = ModuleHandler(mod_path, module)
-    inter = IOHandler(mh)
-    inter.main()
\ No newline at end of file
+    if not params.has_section('module'):
+        params.add_section('module')
+    if delay is not None:
+        params['module']['delay'] = str(delay)
+    if amount is not None:
+        params['module']['amount'] = str(amount)
+
+    for item in overrides:
+        try:
+            name, value = item.split('=', 1)
+            cls, param = name.split('.', 1)
+        except ValueError:
+            print(f'[@] Invalid parameter {item}, use Class.param=value, exit')
+            exit()
+
+        if not params.has_section(cls):
+            params.add_section(cls)
+        params[cls][param] = value
+
+    return params
+
+
+
+if __name__ == '__main__':
+    started = perf_counter()
+
+    parser = argparse.ArgumentParser(description='Mirage module handler')
+    parser.add_argument('mod_path', help='path to modules directory')
+    parser.add_argument('module', help='module file name')
+    parser.add_argument('--headless', nargs='?', const='', metavar='PARAMS_FILE',
+                        help='start without prompts and table, parameters are taken from .ini file')
+    parser.add_argument('--delay', type=int, help='check delay in seconds(headless)')
+    parser.add_argument('--amount', type=int, help='amount of honeypots(headless)')
+    parser.add_argument('--set', action='append', default=[], metavar='CLASS.PARAM=VALUE',
+                        help='set class parameter(headless), can be repeated')
+    parser.add_argument('--phases', action='store_true',
+                        help='time pipeline phases, report is printed on exit and on SIGUSR2')
+    parser.add_argument('--profile', type=int, default=0, metavar='CYCLES',
+                        help='profile first check cycles with cProfile, SIGUSR1 profiles next cycles of running monitor')
+    parser.add_argument('--profile-path', default='./data/profile.pstats', help='where profile stats are dumped')
+    parser.add_argument('--metrics', default='', metavar='[HOST:]PORT',
+                        help='serve Prometheus metrics on local HTTP endpoint, host is 127.0.0.1 by default')
+    args = parser.parse_args()
+
+    phases = PhaseStats() if args.phases else None
+    if phases is not None:
+        atexit.register(lambda: print(phases.report()))
+
+    if args.headless is None:
+        mh = ModuleHandler(args.mod_path, args.module, phases=phases)
+        inter = IOHandler(mh)
+    else:
+        params = read_params(args.headless, args.delay, args.amount, args.set)
+        mh = ModuleHandler(args.mod_path, args.module, headless=True, phases=phases)
+        inter = IOHandler(mh)
+
+    inter.profiler.path = args.profile_path
+    if args.metrics:
+        host, _, port = args.metrics.rpartition(':')
+        try:
+            inter.metrics = MetricsServer(host or '127.0.0.1', int(port))
+            inter.print_info(f'Metrics are served on http://{host or "127.0.0.1"}:{port}/metrics')
+        except (OSError, ValueError) as e:
+            inter.exit(f'{e} - metrics endpoint cannot be started, exit')
+    if args.profile:
+        inter.profile_cycles = args.profile
+        inter.profiler.request(args.profile)
+
+    if args.headless is None:
+        inter.main()
+    else:
+        inter.main_headless(params, started)
\ No newline at end of file
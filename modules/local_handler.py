@@ -1,7 +1,26 @@
 import os
-from json import load
-from hashlib import md5
-from random import randint, choice, shuffle
+import re
+import mmap
+import zlib
+import ctypes
+import struct
+import atexit
+import threading
+from sys import getsizeof
+from array import array
+from json import load, dump, JSONDecodeError
+from collections import deque
+from contextlib import nullcontext
+from select import select
+from time import sleep, monotonic, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from hashlib import md5, sha256, blake2b
+from random import Random
+
+try:
+    import pwd
+except ImportError:#not unix
+    pwd = None
 
 
 
@@ -23,7 +42,7 @@ class LocalHandler:
         if os.path.exists(path):
             if type == 'files' and os.path.isfile(path):
                 return True
-            elif (type == 'dirs' or type == 'logs') and os.path.isdir(path):
+            elif (type == 'dirs' or type == 'logs' or type == 'trees') and os.path.isdir(path):
                 return True
         
         return False
@@ -41,19 +60,917 @@ class LocalHandler:
 
 
 
+class KernelWatcher:
+    '''Abstract class for kernel events sources. Reports (category, path) pairs, queue overflow is reported as (None, None).
+    Paths which lost their watch(deleted, moved or replaced) are collected in lost'''
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd : int = -1
+        self.lost : list[tuple[str, str]] = []
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add(self, path : str, category : str) -> None:
+        '''Adds path to watch list'''
+        pass
+
+    def parse(self, buf : bytes, out : list) -> None:
+        '''Parses raw events buffer'''
+        pass
+
+    def read(self) -> list[tuple]:
+        '''Reads pending events'''
+        out = []
+        for buf in self.__chunks():
+            self.parse(buf, out)
+
+        return out
+
+    def __chunks(self):
+        '''Yields raw events buffers until queue is empty'''
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return
+            if not buf:
+                return
+            yield buf
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class InotifyWatcher(KernelWatcher):
+    '''Linux inotify events source for valuables'''
+    IN_ACCESS, IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x1, 0x2, 0x4, 0x8
+    IN_OPEN, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE = 0x20, 0x40, 0x80, 0x100
+    IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x200, 0x400, 0x800
+    IN_Q_OVERFLOW, IN_IGNORED = 0x4000, 0x8000
+    IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+
+    EVENT = struct.Struct('iIII')#wd, mask, cookie, len
+
+    def __init__(self, files_events : bool = True):
+        super().__init__()
+        self.watches : dict[int, tuple[str, str]] = {}
+        self.masks : dict[str, int] = {
+            'files' : self.IN_DELETE_SELF | self.IN_MOVE_SELF | (self.IN_ACCESS | self.IN_OPEN |
+                                                                self.IN_MODIFY | self.IN_ATTRIB if files_events else 0),
+            'dirs' : self.IN_OPEN | self.IN_ATTRIB | self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_FROM |
+                     self.IN_MOVED_TO | self.IN_DELETE_SELF | self.IN_MOVE_SELF,
+            'logs' : self.IN_DELETE | self.IN_MOVED_FROM | self.IN_DELETE_SELF | self.IN_MOVE_SELF
+        }
+
+        self.fd : int = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add(self, path : str, category : str) -> None:
+        '''Adds path to watch list'''
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.masks[category])
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {path}')
+        self.watches[wd] = (category, path)
+
+    def parse(self, buf : bytes, out : list) -> None:
+        '''Parses raw events buffer'''
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = self.EVENT.unpack_from(buf, offset)
+            offset += self.EVENT.size + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                out.append((None, None))
+                continue
+            if wd not in self.watches:
+                continue
+            if mask & self.IN_IGNORED:
+                self.lost.append(self.watches.pop(wd))
+                continue
+
+            category, path = self.watches[wd]
+            #watch stays on old inode, so path must be watched again
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                self.lost.append(self.watches.pop(wd))
+            #children opens dont change dir stats, only the dir itself counts
+            if category == 'dirs' and length and not mask & (self.IN_CREATE | self.IN_DELETE |
+                                                             self.IN_MOVED_FROM | self.IN_MOVED_TO):
+                continue
+            out.append((category, path))
+
+
+class FanotifyWatcher(KernelWatcher):
+    '''Linux fanotify events source for files. Needs CAP_SYS_ADMIN, skips events made by this process'''
+    FAN_ACCESS, FAN_MODIFY, FAN_OPEN, FAN_Q_OVERFLOW = 0x1, 0x2, 0x20, 0x4000
+    FAN_CLOEXEC, FAN_NONBLOCK, FAN_MARK_ADD = 0x1, 0x2, 0x1
+    AT_FDCWD = -100
+
+    EVENT = struct.Struct('IBBHQii')#event_len, vers, reserved, metadata_len, mask, fd, pid
+
+    def __init__(self):
+        super().__init__()
+        self.libc.fanotify_mark.argtypes = [ctypes.c_int, ctypes.c_uint, ctypes.c_uint64,
+                                            ctypes.c_int, ctypes.c_char_p]
+        self.inodes : dict[tuple[int, int], tuple[str, str]] = {}
+        self.paths : dict[str, tuple[int, int]] = {}#path : inode of its mark
+
+        self.fd : int = self.libc.fanotify_init(self.FAN_CLOEXEC | self.FAN_NONBLOCK,
+                                                os.O_RDONLY | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'fanotify_init failed')
+
+    def add(self, path : str, category : str) -> None:
+        '''Adds file to watch list'''
+        if self.libc.fanotify_mark(self.fd, self.FAN_MARK_ADD, self.FAN_ACCESS | self.FAN_MODIFY | self.FAN_OPEN,
+                                   self.AT_FDCWD, os.fsencode(path)) < 0:
+            raise OSError(ctypes.get_errno(), f'fanotify_mark failed for {path}')
+
+        st = os.stat(path)
+        self.inodes.pop(self.paths.get(path), None)#replaced file
+        self.inodes[(st.st_dev, st.st_ino)] = (category, path)
+        self.paths[path] = (st.st_dev, st.st_ino)
+
+    def parse(self, buf : bytes, out : list) -> None:
+        '''Parses raw events buffer'''
+        offset = 0
+        while offset + self.EVENT.size <= len(buf):
+            length, _, _, _, mask, fd, pid = self.EVENT.unpack_from(buf, offset)
+            offset += length
+
+            if mask & self.FAN_Q_OVERFLOW:
+                out.append((None, None))
+                continue
+            if fd < 0:
+                continue
+            try:
+                st = os.fstat(fd)
+            finally:
+                os.close(fd)
+
+            if pid != os.getpid() and (st.st_dev, st.st_ino) in self.inodes:
+                out.append(self.inodes[(st.st_dev, st.st_ino)])
+
+
+
+class Crc32:
+    '''Fast non-cryptographic checksum with hashlib-like interface. Detects changes only'''
+    digest_size = 4
+
+    def __init__(self):
+        self.value : int = 0
+
+    def update(self, data) -> None:
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f'{self.value:08x}'
+
+    def copy(self) -> 'Crc32':
+        out = Crc32()
+        out.value = self.value
+        return out
+
+
+class StatsTable:
+    '''Compact column storage of primary stats for one valuables category. Rows are aligned with valuables list'''
+    UNAVAILABLE, AVAILABLE, NO_DIGEST = 0, 1, 2
+
+    def __init__(self, category : str, digest_size : int):
+        self.category : str = category
+        self.digest_size : int = digest_size
+
+        self.paths : list[str] = []
+        self.index : dict[str, int] = {}
+        self.state : bytearray = bytearray()
+        self.dev : array = array('Q')
+        self.ino : array = array('Q')
+        self.mtime_ns : array = array('q')
+        self.size : array = array('q')
+        self.atime : array = array('d')
+        self.mtime : array = array('d')
+        self.value : array = array('q')#files count for logs
+        self.digests : bytearray = bytearray()#file hashes or dir listing fingerprints
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, i : int):
+        '''Returns row in the old list layout'''
+        if not self.state[i]:
+            return (0,0,0,0) if self.category == 'files' else 0
+
+        if self.category == 'files':
+            return [self.digest(i).hex(), self.atime[i], self.mtime[i], self.size[i]]
+        elif self.category == 'dirs' or self.category == 'trees':
+            return [self.atime[i], self.mtime[i], self.digest(i).hex()]
+        return [self.value[i]]
+
+    def append(self, path : str, sig : tuple, atime : float = 0.0, mtime : float = 0.0,
+               digest : bytes = b'', value : int = 0) -> None:
+        '''Adds row of available object'''
+        self.index[path] = len(self.paths)
+        self.paths.append(path)
+        self.state.append(self.AVAILABLE if digest or not self.digest_size else self.NO_DIGEST)
+
+        for column, x in zip((self.dev, self.ino, self.mtime_ns, self.size), sig):
+            column.append(x)
+        self.atime.append(atime)
+        self.mtime.append(mtime)
+        self.value.append(value)
+        self.digests += digest.ljust(self.digest_size, b'\0')[:self.digest_size]
+
+    def append_unavailable(self, path : str) -> None:
+        '''Adds row of object which cannot be stated'''
+        self.append(path, (0, 0, 0, 0))
+        self.state[-1] = self.UNAVAILABLE
+
+    def find(self, path : str) -> int:
+        '''Returns row index of path or -1'''
+        i = self.index.get(path, -1)
+        return i if i >= 0 and self.state[i] else -1
+
+    def signature(self, i : int) -> tuple:
+        return (self.dev[i], self.ino[i], self.mtime_ns[i], self.size[i])
+
+    def digest(self, i : int) -> bytes:
+        if self.state[i] != self.AVAILABLE:
+            return b''
+        return bytes(self.digests[i * self.digest_size:(i + 1) * self.digest_size])
+
+    def memory(self) -> int:
+        '''Returns bytes taken by the table itself, paths strings are shared with valuables'''
+        return sum(getsizeof(x) for x in (self.paths, self.index, self.state, self.dev, self.ino, self.mtime_ns,
+                                          self.size, self.atime, self.mtime, self.value, self.digests))
+
+
+class MerkleTree:
+    '''Merkle digests of directory tree built from scandir stats. Every directory digest covers its whole subtree'''
+    def __init__(self, root : str):
+        self.root : str = root
+        self.nodes : dict[str, dict[str, bytes]] = {}#dir path : {child name : child digest}
+        self.digest : bytes = self.__scan(root)
+
+    def __scan(self, path : str) -> bytes:
+        '''Builds digests of subtree and returns its root digest'''
+        children = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            children[entry.name] = self.__scan(entry.path)
+                        else:
+                            st = entry.stat(follow_symlinks=False)
+                            children[entry.name] = blake2b(struct.pack('qqqq', st.st_mode, st.st_ino, st.st_size,
+                                                                       st.st_mtime_ns), digest_size=16).digest()
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+
+        self.nodes[path] = children
+
+        digest = blake2b(digest_size=16)
+        for name in sorted(children):
+            digest.update(name.encode('utf-8', 'surrogateescape') + b'\0' + children[name])
+        return digest.digest()
+
+    def diff(self, old : 'MerkleTree') -> list[str]:
+        '''Returns paths changed since old tree. Only subtrees with different digests are visited'''
+        out = []
+        if old.digest != self.digest:
+            self.__diff(old, self.root, out)
+        return out
+
+    def __diff(self, old : 'MerkleTree', path : str, out : list) -> None:
+        new_children = self.nodes.get(path, {})
+        old_children = old.nodes.get(path, {})
+
+        for name in sorted(new_children.keys() | old_children.keys()):
+            if new_children.get(name) == old_children.get(name):
+                continue
+
+            child = os.path.join(path, name)
+            if child in self.nodes and child in old.nodes:
+                self.__diff(old, child, out)
+            else:
+                out.append(child)
+
+
+class LogFollower:
+    '''Follows log files of directory by byte offsets and inode identity. Only appended bytes are read'''
+    HEAD_SIZE = 32
+
+    def __init__(self, directory : str, buffer_size : int = 65536):
+        self.directory : str = directory
+        self.buf : bytearray = bytearray(buffer_size)
+        self.dir_mtime : int = -1
+        self.files : dict[str, list] = {}#file name : [dev, ino, offset, head]
+        self.partial : dict[str, bytes] = {}#unfinished last line of file
+
+        for name, st in self.__stat(self.__list()).items():#follow from the end
+            self.files[name] = [st.st_dev, st.st_ino, st.st_size, self.__head(name)]
+
+    def __list(self) -> list[str]:
+        '''Lists files of directory, directory is read again only if its mtime changed'''
+        st = os.stat(self.directory)
+        if st.st_mtime_ns == self.dir_mtime:
+            return list(self.files.keys())
+
+        self.dir_mtime = st.st_mtime_ns
+        with os.scandir(self.directory) as entries:
+            return [entry.name for entry in entries if entry.is_file()]
+
+    def __stat(self, names : list[str]) -> dict[str, os.stat_result]:
+        out = {}
+        for name in names:
+            try:
+                out[name] = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+        return out
+
+    def __head(self, name : str) -> bytes:
+        '''Reads first bytes of file, they tell rotated file from new file with reused inode'''
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                return f.read(self.HEAD_SIZE)
+        except OSError:
+            return b''
+
+    def follow(self):
+        '''Yields (kind, path, data) tuples. Kinds are record, created, rotated, replaced, truncated and deleted'''
+        try:
+            current = self.__stat(self.__list())
+        except OSError:
+            if self.files:
+                self.files = {}
+                yield ('deleted', self.directory, b'')
+            return
+
+        #files are matched by inode into new map, so rename chains(log.1 -> log.2, log -> log.1) keep offsets
+        identities = {(st.st_dev, st.st_ino) : name for name, st in current.items()}
+        files, partial, events = {}, {}, []
+        for name, entry in self.files.items():
+            dev, ino, offset, head = entry
+            st = current.get(name)
+            if st is not None and (st.st_dev, st.st_ino) == (dev, ino):
+                files[name] = entry
+                if name in self.partial:
+                    partial[name] = self.partial[name]
+                continue
+
+            path = os.path.join(self.directory, name)
+            moved = identities.get((dev, ino))
+            if moved is not None and head and self.__head(moved).startswith(head):
+                files[moved] = entry#keep reading rotated file
+                if name in self.partial:
+                    partial[moved] = self.partial[name]
+                events.append(('rotated', path, b''))
+            elif st is None:
+                events.append(('deleted', path, b''))
+            else:
+                events.append(('replaced', path, b''))
+
+        self.files, self.partial = files, partial
+        yield from events
+
+        for name, st in current.items():
+            path = os.path.join(self.directory, name)
+            if name not in self.files:
+                self.files[name] = [st.st_dev, st.st_ino, 0, b'']
+                yield ('created', path, b'')
+
+            if len(self.files[name][3]) < self.HEAD_SIZE and st.st_size > len(self.files[name][3]):
+                self.files[name][3] = self.__head(name)
+
+            if st.st_size < self.files[name][2]:
+                self.files[name][2] = 0
+                self.partial.pop(name, None)
+                yield ('truncated', path, b'')
+
+            if st.st_size > self.files[name][2]:
+                yield from self.__read(name, path, st.st_size)
+
+    def __read(self, name : str, path : str, size : int):
+        '''Reads appended bytes with reusable buffer and yields complete lines as records'''
+        view = memoryview(self.buf)
+        try:
+            with open(path, 'rb', buffering=0) as f:
+                f.seek(self.files[name][2])
+                while self.files[name][2] < size:
+                    n = f.readinto(view[:min(len(view), size - self.files[name][2])])
+                    if not n:
+                        break
+                    self.files[name][2] += n
+
+                    lines = (self.partial.pop(name, b'') + view[:n]).split(b'\n')
+                    last = lines.pop()
+                    for line in lines:
+                        yield ('record', path, line)
+
+                    if len(last) >= len(self.buf):#record without line breaks
+                        yield ('record', path, last)
+                    elif last:
+                        self.partial[name] = last
+        except OSError:
+            return
+
+
+class HashPool:
+    '''Hashes many files concurrently. Argument max_inflight limits total size of files being hashed at once'''
+    def __init__(self, hash_func, workers : int = 4, max_inflight : int = 256 * 1024 * 1024):
+        self.hash_func = hash_func
+        self.workers : int = max(1, int(workers))
+        self.max_inflight : int = int(max_inflight)
+        self.executor = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+        self.hashed_bytes : int = 0
+        self.hashed_time : float = 0.0
+
+    def hash_many(self, paths : list[str]) -> dict[str, str]:
+        '''Hashes files and returns path : hash map'''
+        start = monotonic()
+        out = {}
+
+        if self.executor is None:
+            for path in paths:
+                out[path] = self.hash_func(path)
+                self.hashed_bytes += self.__size(path)
+        else:
+            pending = {}
+            inflight = 0
+            for path in paths:
+                size = self.__size(path)
+                while pending and inflight + size > self.max_inflight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        inflight -= self.__collect(future, pending, out)
+
+                inflight += size
+                pending[self.executor.submit(self.hash_func, path)] = (path, size)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.__collect(future, pending, out)
+
+        self.hashed_time += monotonic() - start
+        return out
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def __collect(self, future, pending : dict, out : dict) -> int:
+        '''Moves finished hash to output and returns its file size'''
+        path, size = pending.pop(future)
+        out[path] = future.result()
+        self.hashed_bytes += size
+        return size
+
+    def __size(self, path : str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def throughput(self) -> float:
+        '''Returns hashing throughput in MB/s'''
+        if not self.hashed_time:
+            return 0.0
+        return self.hashed_bytes / 1048576 / self.hashed_time
+
+
+class FdScanner:
+    '''Finds processes holding watched objects open by reading /proc/<pid>/fd. Fd table is re-read only for new processes and
+    processes whose fds count changed, all tables are re-read every full_rescan seconds'''
+    def __init__(self, full_rescan : float = 30.0):
+        self.full_rescan : float = full_rescan
+        self.next_full : float = 0.0
+        self.own : int = os.getpid()
+
+        self.pids : dict[int, tuple] = {}#pid : (fd dir ctime, fds count)
+        self.reported : dict[int, set] = {}#pid : (dev, ino) already reported
+
+    def scan(self, index : dict[tuple, str]) -> list[tuple]:
+        '''Returns (path, pid, user, cmdline) of handles opened on indexed (dev, ino) since previous scan'''
+        now = monotonic()
+        full = now >= self.next_full
+        if full:
+            self.next_full = now + self.full_rescan
+
+        out = []
+        alive = {}
+        try:
+            entries = os.scandir('/proc')
+        except OSError:
+            return out
+
+        with entries:
+            for entry in entries:
+                if not entry.name.isdigit() or int(entry.name) == self.own:
+                    continue
+
+                pid = int(entry.name)
+                try:
+                    st = os.stat(f'/proc/{pid}/fd')
+                except OSError:#process is gone or not permitted
+                    continue
+
+                #fd dir of new process with same pid has other ctime, count is 0 on old kernels
+                sig = alive[pid] = (st.st_ctime_ns, st.st_size)
+                old = self.pids.get(pid)
+                if not full and old == sig and sig[1]:
+                    continue
+                if old is None or old[0] != sig[0]:
+                    self.reported.pop(pid, None)
+
+                found = self.__read_fds(pid, index)
+                for inode in found - self.reported.get(pid, set()):
+                    out.append((index[inode], pid, self.__user(st.st_uid), self.__cmdline(pid)))
+                self.reported[pid] = found
+
+        for pid in self.pids.keys() - alive.keys():
+            self.reported.pop(pid, None)
+        self.pids = alive
+
+        return out
+
+    def __read_fds(self, pid : int, index : dict[tuple, str]) -> set:
+        '''Returns indexed (dev, ino) opened by process'''
+        found = set()
+        try:
+            with os.scandir(f'/proc/{pid}/fd') as fds:
+                for fd in fds:
+                    try:
+                        st = fd.stat()
+                    except OSError:
+                        continue
+                    if (st.st_dev, st.st_ino) in index:
+                        found.add((st.st_dev, st.st_ino))
+        except OSError:
+            pass
+        return found
+
+    def __user(self, uid : int) -> str:
+        try:
+            return pwd.getpwuid(uid).pw_name
+        except (KeyError, AttributeError):
+            return str(uid)
+
+    def __cmdline(self, pid : int) -> str:
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as file:
+                return file.read().replace(b'\0', b' ').decode('utf-8', 'replace').strip()
+        except OSError:
+            return ''
+
+
+class TrapRegistry:
+    '''Persistent registry of placed traps. Traps are found by normalized path or by (device, inode),
+    so renamed or hard-linked trap is still recognized. Size and mtime of trap are compared before renamed trap is taken,
+    so file with reused inode is not taken for trap. Every trap keeps id of placement batch'''
+    def __init__(self, path : str = ''):
+        self.path : str = path
+        self.traps : dict[str, list] = {}#normalized path : [dev, ino, batch, size, mtime_ns]
+        self.inodes : dict[tuple, str] = {}#(dev, ino) : normalized path
+        self.batches : dict[int, float] = {}#batch : placement time
+
+        self.__load()
+
+    def __len__(self) -> int:
+        return len(self.traps)
+
+    def __contains__(self, path : str) -> bool:
+        return self.find(path) is not None
+
+    def normalize(self, path : str) -> str:
+        '''Returns path in form used as registry key'''
+        return os.path.normcase(os.path.abspath(path))
+
+    def new_batch(self) -> int:
+        '''Opens new placement batch and returns its id'''
+        batch = max(self.batches, default=0) + 1
+        self.batches[batch] = time()
+        return batch
+
+    def add(self, path : str, batch : int) -> None:
+        '''Registers trap placed by batch'''
+        key = self.normalize(path)
+        try:
+            st = os.stat(path)
+            dev, ino, size, mtime_ns = st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+        except OSError:
+            dev, ino, size, mtime_ns = 0, 0, -1, -1
+
+        self.remove(key)
+        self.traps[key] = [dev, ino, batch, size, mtime_ns]
+        if ino:
+            self.inodes[(dev, ino)] = key
+
+    def remove(self, path : str) -> None:
+        '''Forgets trap'''
+        key = self.normalize(path)
+        if key not in self.traps:
+            return
+        dev, ino = self.traps.pop(key)[:2]
+        if self.inodes.get((dev, ino)) == key:
+            del self.inodes[(dev, ino)]
+
+    def find(self, path : str) -> str | None:
+        '''Returns key of trap placed in path, None if path is not a trap. Trap found by inode whose registered path
+        does not hold it anymore is taken as renamed and moved to new key if its size and mtime are same, else it is forgotten'''
+        key = self.normalize(path)
+        if key in self.traps:
+            return key
+
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        old = self.inodes.get((st.st_dev, st.st_ino))
+        if old is None:
+            return None
+
+        try:
+            registered = os.stat(old)
+            if (registered.st_dev, registered.st_ino) == (st.st_dev, st.st_ino):#hard link
+                return old
+        except (OSError, ValueError):
+            pass
+
+        entry = self.traps.pop(old)
+        if (st.st_size, st.st_mtime_ns) != tuple(entry[3:5]):#inode of deleted trap is reused
+            del self.inodes[(st.st_dev, st.st_ino)]
+            self.save()
+            return None
+
+        self.traps[key] = entry
+        self.inodes[(st.st_dev, st.st_ino)] = key
+        self.save()
+        return key
+
+    def verify(self, path : str) -> bool:
+        '''Returns True if trap is in place with its inode and takes its new size and mtime. Replaced trap is forgotten,
+        deleted or moved one is kept, so it is found by inode after rename'''
+        key = self.normalize(path)
+        if key not in self.traps:
+            return False
+
+        entry = self.traps[key]
+        try:
+            st = os.stat(key)
+        except (OSError, ValueError):
+            return False
+
+        if entry[1] and (st.st_dev, st.st_ino) == tuple(entry[:2]):
+            entry[3:5] = st.st_size, st.st_mtime_ns
+            return True
+
+        self.remove(key)
+        return False
+
+    def prune(self) -> list[str]:
+        '''Forgets replaced traps and returns their paths, sizes and mtimes of traps in place are taken again'''
+        return [key for key in list(self.traps) if not self.verify(key) and key not in self.traps]
+
+    def batch(self, path : str) -> int:
+        '''Returns placement batch of trap, 0 if path is not a trap'''
+        key = self.find(path)
+        return self.traps[key][2] if key is not None else 0
+
+    def __load(self) -> None:
+        '''Loads registry saved by previous run'''
+        if not self.path or not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.path, 'r') as file:
+                data = load(file)
+
+            for key, dev, ino, batch, *identity in data['traps']:#size and mtime are missing in old registry
+                self.traps[key] = [dev, ino, batch, *(identity or [-1, -1])]
+                if ino:
+                    self.inodes[(dev, ino)] = key
+            self.batches = {int(k) : v for k, v in data['batches'].items()}
+
+        except (OSError, JSONDecodeError, KeyError, TypeError, ValueError):
+            print('invalid honeypots registry format, it will be rebuilt')
+            self.traps, self.inodes, self.batches = {}, {}, {}
+
+    def save(self) -> None:
+        '''Saves registry atomically'''
+        if not self.path:
+            return
+
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as file:
+                dump({'traps' : [[k, *v] for k, v in self.traps.items()], 'batches' : self.batches},
+                     file, separators=(',', ':'))
+            os.replace(tmp, self.path)
+
+        except OSError as e:
+            print(f'{e} - honeypots registry cannot be saved')
+
+
+class ContentPool:
+    '''Pool of pregenerated honeypots contents. Templates may have %password%, %username%, %email%, %host%, %ip%, %date%, %token%
+    and %number% placeholders. Every content is filled with rendered templates up to size taken from sizes range'''
+    def __init__(self, templates : list[str], words : list[str], rng : Random,
+                 size : int = 1024, sizes : tuple[int, int] = (64, 8192), random_border : int = 4096):
+        self.templates : list[str] = templates
+        self.words : list[str] = words or ['admin']
+        self.rng : Random = rng
+        self.size : int = size
+        self.sizes : tuple[int, int] = sizes
+        self.RANDOM_BORDER : int = random_border
+        self.PLACEHOLDER = re.compile(r'%(\w+)%')
+
+        self.placeholders : dict = {
+            'password' : self.__password,
+            'username' : self.__username,
+            'email' : lambda: f'{self.__username()}@{self.__host()}',
+            'host' : self.__host,
+            'ip' : lambda: f'10.{self.rng.randint(0, 255)}.{self.rng.randint(0, 255)}.{self.rng.randint(1, 254)}',
+            'date' : lambda: f'{self.rng.randint(2019, 2025)}-{self.rng.randint(1, 12):02}-{self.rng.randint(1, 28):02}',
+            'token' : lambda: f'{self.rng.getrandbits(128):032x}',
+            'number' : lambda: str(self.rng.randint(0, self.RANDOM_BORDER))
+        }
+        self.contents : list[str] = []
+
+    def __password(self) -> str:
+        '''Generates fake password'''
+        components = [str(self.rng.randint(0, self.RANDOM_BORDER)),
+                      hex(self.rng.randint(0, self.RANDOM_BORDER))[2:],
+                      self.rng.choice(self.words)]
+        self.rng.shuffle(components)
+        return ''.join(components)
+
+    def __username(self) -> str:
+        return self.rng.choice(self.words) + (str(self.rng.randint(1, 99)) if self.rng.random() < 0.5 else '')
+
+    def __host(self) -> str:
+        return f'{self.rng.choice(self.words)}.{self.rng.choice(("com", "net", "org", "local"))}'
+
+    def __render(self, template : str) -> str:
+        '''Replaces placeholders, unknown ones are kept'''
+        return self.PLACEHOLDER.sub(lambda m: self.placeholders[m.group(1)]() if m.group(1) in self.placeholders else m.group(0),
+                                    template)
+
+    def __content(self) -> str:
+        '''Makes content of size taken from log-uniform distribution, so small files are more often than big ones'''
+        low, high = self.sizes
+        target = int(low * (high / low) ** self.rng.random()) if 0 < low < high else low
+
+        lines = [self.__render(self.rng.choice(self.templates))]
+        length = len(lines[0])
+        while length < target:
+            lines.append(self.__render(self.rng.choice(self.templates)))
+            length += len(lines[-1]) + 1
+
+        return '\n'.join(lines)
+
+    def fill(self) -> None:
+        '''Generates pool contents'''
+        self.contents = [self.__content() for _ in range(self.size)] if self.templates else []
+
+    def take(self, amount : int) -> list[str]:
+        '''Takes contents from pool, pool is generated again when it is drained'''
+        out = []
+        while len(out) < amount:
+            if not self.contents:
+                self.fill()
+                if not self.contents:
+                    return out + [''] * (amount - len(out))
+            n = min(amount - len(out), len(self.contents))
+            out.extend(self.contents[-n:])
+            del self.contents[-n:]
+        return out
+
+
+
 class LocalMonitor(LocalHandler):
-    '''Monitor for local files(and processes(?) soon). Argument config_path sets path to config .json file with dirs, files and logs to monitor.'''
+    '''Monitor for local files(and processes(?) soon). Argument config_path sets path to config .json file with dirs, files and logs to monitor.
+    Argument backend sets events source: auto, fanotify, inotify or poll.
+    Arguments hash_workers and hash_inflight_mb set hashing pool size and limit of file megabytes hashed at once.
+    Argument hash_algorithm sets files digest: md5, sha256, blake2b or crc32(change detection only).
+    Argument baseline_path sets file where baseline is kept between restarts, empty value disables it.
+    Argument baseline_save_interval sets how often changed baseline is saved in seconds, it is also saved on exit.
+    Argument intervals sets own check intervals of categories in seconds, e.g. files=5,dirs=30. Other categories are checked every check() call.
+    Argument fd_scan_interval sets how often processes are scanned for open valuable files on Linux, 0 disables it.
+    Check phases are timed when handler sets phases attribute.'''
     def __init__(self, 
-                 config_path : str='./data/data.json'):
+                 config_path : str='./data/data.json',
+                 backend : str = 'auto',
+                 hash_workers : int = 4,
+                 hash_inflight_mb : int = 256,
+                 hash_algorithm : str = 'md5',
+                 baseline_path : str = './data/baseline.json',
+                 baseline_save_interval : float = 60.0,
+                 intervals : str = '',
+                 fd_scan_interval : float = 1.0):
         super().__init__()
         self.config_path : str = config_path
+        self.backend : str = backend
         self.UNAVAILABLE_FILE : tuple = (0,0,0,0)
+        self.MMAP_THRESHOLD : int = 64 * 1048576
+        self.APPEND_THRESHOLD : int = 1048576#files from this size keep resumable hash state
+        self.SAMPLE_BLOCKS : int = 4
+        self.HASH_ALGORITHMS : dict = {
+            'md5' : md5,
+            'sha256' : sha256,
+            'blake2b' : blake2b,
+            'crc32' : Crc32
+        }
+
+        if hash_algorithm not in self.HASH_ALGORITHMS:
+            print(f'unknown hash algorithm {hash_algorithm}, md5 is used')
+            hash_algorithm = 'md5'
+        self.hash_algorithm : str = hash_algorithm
+        self.baseline_path : str = baseline_path
+        self.baseline_save_interval : float = float(baseline_save_interval)
+        self.__baseline_dirty : bool = False
+        self.__baseline_lock : threading.Lock = threading.Lock()
+        self.__stop_threads : threading.Event = threading.Event()#stops baseline saver and open handles scanner
+        self.__buffers = threading.local()#reusable read buffer for every hashing thread
+        self.__hash_states : dict[str, tuple] = {}#path : ((dev, ino), hashed size, hash state, sampled blocks)
 
         self.__valuables : dict[str : list] = {}
-        self.primary_stats : dict[str : list] = {}
+        self.primary_stats : dict[str : StatsTable] = {}
+        self.__watchers : list = []
+        self.__unwatched : dict[str, tuple[str, tuple | None]] = {}#path : (category, stat signature) of valuables which lost their watch
+        self.__files_groups : dict[str, dict[str, str]] = {}#parent dir : {file name : path}
+        self.__trees : dict[str, MerkleTree] = {}
+        self.__followers : dict[str, LogFollower] = {}
+        self.__log_records : deque = deque(maxlen=10000)#(path, record) read from logs
+        self.__cycle_stats : dict | None = None#files stats taken by current check cycle
+        self.__hash_pool : HashPool = HashPool(self.__calculate_hash, hash_workers, int(hash_inflight_mb) * 1048576)
+        self.intervals : dict[str, float] = self.__parse_intervals(intervals)
+        self.__next_checks : dict[str, float] = {}#category : monotonic time of next check
+        self.fd_scan_interval : float = float(fd_scan_interval)
+        self.__fd_scanner : FdScanner | None = FdScanner() if self.fd_scan_interval and os.path.isdir('/proc/self/fd') else None
+        self.__scanner : threading.Thread | None = None
+        self.__handle_suspects : deque = deque(maxlen=10000)#files found open by scanner since last check
+        self.__open_handles : deque = deque(maxlen=10000)#(path, pid, user, cmdline) of processes holding files open
+        self.__details : dict[str, dict] = {}#suspect : old and new stats of last check
+        self.phases = None#phases timer of handler
 
         self.__determine_vals()
-        self.reset_primary_stats()
+        self.__load_baseline()
+        self.update_primary_stats()
+        self.__flush_baseline()
+        if self.baseline_path:#saving is kept off check cycle
+            threading.Thread(target=self.__save_periodically, name='baseline-saver', daemon=True).start()
+            atexit.register(self.__flush_baseline)
+        print(f'baseline hashed: {self.__hash_pool.hashed_bytes / 1048576:.1f} MB, {self.__hash_pool.throughput():.1f} MB/s')
+        print(f'baseline memory: {self.baseline_memory():.0f} bytes per entry')
+        self.__start_watchers()
+        if self.__fd_scanner is not None:#scan has own tick, so short opens between checks are found
+            self.__scanner = threading.Thread(target=self.__scan_periodically, name='handles-scanner', daemon=True)
+            self.__scanner.start()
+
+    def __parse_intervals(self, intervals : str) -> dict[str, float]:
+        '''Parses category=seconds pairs'''
+        out = {}
+        for item in filter(None, intervals.split(',')):
+            try:
+                k, value = item.split('=')
+                out[k.strip()] = float(value)
+            except ValueError:
+                print(f'invalid interval {item}, it is ignored')
+        return out
+
+    def __due_categories(self, delay : float) -> list[str]:
+        '''Returns categories which must be checked now. Own intervals are kept on fixed grid, missed checks are skipped'''
+        now = monotonic()
+        due = []
+
+        for k in self.__valuables.keys():
+            interval = self.intervals.get(k)
+            if not interval:
+                due.append(k)
+                continue
+
+            #check happens on the call closest to planned time
+            next_check = self.__next_checks.get(k, now)
+            if now + delay / 2 < next_check:
+                continue
+
+            next_check += interval
+            if next_check <= now:
+                next_check += ((now - next_check) // interval + 1) * interval
+            self.__next_checks[k] = next_check
+            due.append(k)
+
+        return due
 
     def __determine_vals(self) -> None:
         '''Parses .json file and formats it to make proper paths from it'''
@@ -78,75 +995,371 @@ class LocalMonitor(LocalHandler):
 
             self.__valuables[k] = pack
 
-    def __calculate_hash(self, path: str, buffer_size: int = 65536) -> str:
-        '''Calculates buffer hash'''
-        md5_hash = md5()
+        self.__group_files()
+
+    def __group_files(self) -> None:
+        '''Groups valuable files by parent directory for batch stat'''
+        self.__files_groups = {}
+        for path in self.__valuables.get('files', []):
+            parent, name = os.path.split(path)
+            self.__files_groups.setdefault(parent, {})[name] = path
+
+    def __stat_files(self) -> dict[str, os.stat_result]:
+        '''Stats valuable files. On Windows scandir caches stats, so every parent directory is read with one pass'''
+        out = {}
+        for parent, names in self.__files_groups.items():
+            if os.name == 'nt' and len(names) > 1:
+                try:
+                    with os.scandir(parent) as entries:
+                        for entry in entries:
+                            if entry.name in names:
+                                out[names[entry.name]] = entry.stat()
+                except OSError:
+                    pass
+
+            for path in names.values():#single stat fallback
+                if path not in out:
+                    try:
+                        out[path] = os.stat(path)
+                    except OSError:
+                        continue
+
+        return out
+
+    def __load_baseline(self) -> None:
+        '''Loads baseline saved by previous run. Entries are validated by stat signature on next update'''
+        if not self.baseline_path or not self.verify_path(self.baseline_path, 'files'):
+            return
+
+        try:
+            with open(self.baseline_path, 'r') as file:
+                data = load(file)
+
+            if data['version'] != 2 or data['hash_algorithm'] != self.hash_algorithm:
+                print('baseline file is outdated, it will be rebuilt')
+                return
+
+            for k, path, dev, ino, mtime_ns, size, digest, value in data['entries']:
+                if k not in self.primary_stats:
+                    self.primary_stats[k] = StatsTable(k, self.__digest_size(k))
+                self.primary_stats[k].append(path, (dev, ino, mtime_ns, size),
+                                             digest=bytes.fromhex(digest), value=value)
+
+        except (OSError, JSONDecodeError, KeyError, TypeError, ValueError):
+            print('invalid baseline file format, it will be rebuilt')
+            self.primary_stats = {}
+            return
+
+        print(f'baseline loaded: {sum(map(len, self.primary_stats.values()))} entries')
+
+    def __save_periodically(self) -> None:
+        while not self.__stop_threads.wait(self.baseline_save_interval):
+            self.__flush_baseline()
+
+    def __flush_baseline(self) -> None:
+        '''Saves baseline if it was changed since last save'''
+        with self.__baseline_lock:
+            if not self.__baseline_dirty:
+                return
+            self.__baseline_dirty = False
+            self.__save_baseline(dict(self.primary_stats))#tables are replaced, not changed, so snapshot is consistent
+
+    def __save_baseline(self, tables : dict[str, StatsTable]) -> None:
+        '''Saves baseline atomically'''
+        if not self.baseline_path:
+            return
+
+        entries = []
+        for k, table in tables.items():
+            for i, path in enumerate(table.paths):
+                if table.state[i]:
+                    entries.append([k, path, *table.signature(i), table.digest(i).hex(), table.value[i]])
+
+        tmp = self.baseline_path + '.tmp'
+        try:
+            with open(tmp, 'w') as file:
+                dump({'version' : 2, 'hash_algorithm' : self.hash_algorithm, 'entries' : entries},
+                     file, separators=(',', ':'))
+            os.replace(tmp, self.baseline_path)
+
+        except OSError as e:
+            print(f'{e} - baseline cannot be saved')
+
+    def __start_watchers(self) -> None:
+        '''Starts kernel events watchers for valuables. Falls back to polling if they are unavailable'''
+        self.__stop_watchers()
+        if self.backend == 'poll' or not os.path.exists('/proc/self'):
+            return
+
         try:
-            with open(path, 'rb') as f:
-                for chunk in iter(lambda: f.read(buffer_size), b''):
-                    md5_hash.update(chunk)
+            if self.backend in ('auto', 'fanotify'):
+                try:
+                    self.__watchers.append(FanotifyWatcher())
+                except (OSError, AttributeError):
+                    if self.backend == 'fanotify':
+                        print('fanotify is not permitted, inotify is used')
+
+            self.__watchers.append(InotifyWatcher(files_events=not self.__watchers))
+
+            for k in self.__valuables.keys():
+                for obj in self.__valuables[k]:
+                    self.__watch(obj, k)
+
+        except (OSError, AttributeError) as e:
+            print(f'{e} - events backend is unavailable, polling is used')
+            self.__stop_watchers()
+
+    def __watch(self, obj : str, category : str) -> None:
+        '''Adds valuable to running watchers. Files go to fanotify if it is used'''
+        inotify = self.__watchers[-1]
+        if category not in inotify.masks:#trees are polled
+            return
+
+        if category == 'files' and len(self.__watchers) > 1:
+            self.__watchers[0].add(obj, category)
+        inotify.add(obj, category)
+
+    def __stop_watchers(self) -> None:
+        '''Closes kernel events watchers'''
+        for watcher in self.__watchers:
+            watcher.close()
+        self.__watchers = []
+        self.__unwatched = {}
+
+    def __rewatch(self) -> list[tuple[str, str]]:
+        '''Polls valuables which lost their watch and watches them again when they exist. Returns (category, path) of changed ones'''
+        for watcher in self.__watchers:
+            for category, path in watcher.lost:
+                self.__unwatched[path] = (category, self.__stat_signature(path))
+            watcher.lost.clear()
+
+        changed = []
+        for path, (category, sig) in list(self.__unwatched.items()):
+            new = self.__stat_signature(path)
+            if new != sig:
+                changed.append((category, path))
+            if new is None:
+                self.__unwatched[path] = (category, new)
+                continue
+
+            try:
+                self.__watch(path, category)
+                del self.__unwatched[path]
+            except OSError:
+                self.__unwatched[path] = (category, new)
+
+        return changed
 
-            return md5_hash.hexdigest()
+    def __stat_signature(self, path : str) -> tuple | None:
+        try:
+            return self.__signature(os.stat(path))
+        except OSError:
+            return None
+
+    def __read_events(self, delay : float, due : list[str]) -> dict[str : list]:
+        '''Collects pending kernel events into suspects map. Polled categories are checked only when they are due'''
+        suspects_map = {k : [] for k in self.__valuables.keys()}
+        overflow = False
+
+        with self.__timed('read_events'):
+            for watcher in self.__watchers:
+                for category, path in watcher.read():
+                    if category is None:
+                        overflow = True
+                    elif category != 'logs' and path not in suspects_map[category]:
+                        suspects_map[category].append(path)
+
+            for category, path in self.__rewatch():
+                if category != 'logs' and path not in suspects_map[category]:
+                    suspects_map[category].append(path)
+
+        #events were lost, fall back to one polling cycle
+        if overflow:
+            for k, suspects in self.__poll(delay, list(self.__valuables.keys())).items():
+                suspects_map[k].extend(x for x in suspects if x not in suspects_map[k])
+        else:#logs and trees are polled, logs events only wake up the monitor
+            if 'logs' in due:
+                with self.__timed('check_logs'):
+                    suspects_map['logs'] = self.__check_logs()
+            if 'trees' in due:
+                with self.__timed('check_trees'):
+                    suspects_map['trees'] = self.__check_trees()
+                #drop events caused by own tree listing, e.g. opens of watched dirs inside trees
+                for watcher in self.__watchers:
+                    watcher.read()
+
+            #rows of reported categories are taken again, so open handles index, details and saved baseline follow events
+            changed = [k for k, suspects in suspects_map.items() if suspects]
+            if changed:
+                with self.__timed('update_primary_stats'):
+                    self.update_primary_stats(changed)
+
+        return suspects_map
+
+    def __signature(self, st : os.stat_result) -> tuple:
+        '''Returns stat signature, which changes with object content'''
+        if os.name == 'nt':#scandir stats have no inode on Windows
+            return (0, 0, st.st_mtime_ns, st.st_size)
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def __hash_changed_files(self) -> tuple[dict, dict]:
+        '''Stats valuable files and hashes changed ones in hashing pool. Returns path : stat and path : hash maps'''
+        files_stats = self.__cycle_stats if self.__cycle_stats is not None else self.__stat_files()
+        self.__cycle_stats = None
+        old = self.primary_stats.get('files', StatsTable('files', 0))
+        changed = []
+
+        for obj, st in files_stats.items():
+            i = old.find(obj)
+            if i < 0 or old.signature(i) != self.__signature(st):
+                changed.append(obj)
+
+        with self.__timed('hash_files'):
+            digests = self.__hash_pool.hash_many(changed)
+        if self.phases is not None:
+            self.phases.count('hashed_files', len(changed))
+
+        #hashing moves atime, so changed files are stated again
+        for obj in changed:
+            try:
+                files_stats[obj] = os.stat(obj)
+            except OSError:
+                files_stats.pop(obj)
+
+        return files_stats, digests
+
+    def __digest_size(self, category : str) -> int:
+        '''Returns digest size of category: file hash, dir listing fingerprint or nothing for logs'''
+        if category == 'files':
+            return self.HASH_ALGORITHMS[self.hash_algorithm]().digest_size
+        elif category == 'dirs' or category == 'trees':
+            return 16
+        return 0
+
+    def __fingerprint(self, names : list[str]) -> bytes:
+        '''Returns fingerprint of dir listing'''
+        return blake2b('\0'.join(sorted(names)).encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+
+    def __calculate_hash(self, path: str, buffer_size: int = 65536) -> str:
+        '''Calculates buffer hash. Grown files with intact sampled prefix blocks are hashed from previous state'''
+        try:
+            with open(path, 'rb', buffering=0) as f:
+                st = os.fstat(f.fileno())
+                state = self.__hash_states.pop(path, None)
+
+                if state is not None and state[0] == (st.st_dev, st.st_ino) and st.st_size > state[1] and \
+                    self.__prefix_intact(f, state[3]):
+                    file_hash = state[2]
+                    f.seek(state[1])
+                else:
+                    file_hash = self.HASH_ALGORITHMS[self.hash_algorithm]()
+
+                if f.tell() == 0 and st.st_size >= self.MMAP_THRESHOLD:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        file_hash.update(mm)
+                        f.seek(len(mm))
+
+                else:
+                    buf = getattr(self.__buffers, 'buf', None)
+                    if buf is None or len(buf) != buffer_size:
+                        buf = self.__buffers.buf = bytearray(buffer_size)
+                    view = memoryview(buf)
+
+                    while n := f.readinto(buf):
+                        file_hash.update(view[:n])
+
+                size = f.tell()
+                if size >= self.APPEND_THRESHOLD:
+                    self.__hash_states[path] = ((st.st_dev, st.st_ino), size, file_hash.copy(),
+                                                self.__sample_blocks(f, size, buffer_size))
+
+            return file_hash.hexdigest()
         
-        except (IOError, OSError) as e:
+        except (IOError, OSError, ValueError) as e:
             return ''
 
+    def __sample_blocks(self, f, size : int, block_size : int) -> list[tuple]:
+        '''Returns (offset, length, crc32) of blocks spread over file, the first and the last ones included'''
+        blocks = (size + block_size - 1) // block_size
+        indexes = {blocks * i // self.SAMPLE_BLOCKS for i in range(self.SAMPLE_BLOCKS)} | {blocks - 1}
+
+        out = []
+        for i in sorted(indexes):
+            data = os.pread(f.fileno(), min(block_size, size - i * block_size), i * block_size)
+            out.append((i * block_size, len(data), zlib.crc32(data)))
+        return out
+
+    def __prefix_intact(self, f, samples : list[tuple]) -> bool:
+        '''Checks if sampled blocks of already hashed prefix were not changed'''
+        for offset, length, crc in samples:
+            if zlib.crc32(os.pread(f.fileno(), length, offset)) != crc:
+                return False
+        return True
+
     def __check_logs(self) -> list:
         '''Checks valuable logs'''
         suspects = []
 
-        for i, log in enumerate(self.__valuables['logs']):
-            try:
-                if len(os.listdir(log)) < self.primary_stats['logs'][i][0]:
-                    suspects.append(self.__valuables['logs'][i])
-            
-            except FileExistsError:
-                continue
-            except PermissionError:
+        for log in self.__valuables['logs']:
+            if log not in self.__followers:
                 continue
 
+            for kind, path, data in self.__followers[log].follow():
+                if kind == 'record':
+                    self.__log_records.append((path, data))
+                elif kind in ('truncated', 'replaced', 'deleted') and path not in suspects:
+                    suspects.append(path)
+
         return suspects
 
     def __check_files(self) -> list:
         '''Checks valuable files'''
         suspects = []
+        stats = self.__cycle_stats = self.__stat_files()#reused by baseline update
+        table = self.primary_stats['files']
+
         for i, file in enumerate(self.__valuables['files']):
-            if self.primary_stats['files'][i] == self.UNAVAILABLE_FILE:
+            if not table.state[i]:#created file is suspect as with events backend
+                if file in stats:
+                    suspects.append(file)
                 continue
 
-            try:
-                if os.path.getatime(file) != self.primary_stats['files'][i][1]:
-                    suspects.append(self.__valuables['files'][i])
-
-                elif os.path.getmtime(file) != self.primary_stats['files'][i][2] or \
-                    os.path.getsize(file) != self.primary_stats['files'][i][3]:
-
-                    if self.__calculate_hash(file) != self.primary_stats['files'][i][0]:
-                        suspects.append(self.__valuables['files'][i])
-                        continue
+            if file not in stats:#deleted file is suspect, other stat errors are not
+                try:
+                    os.stat(file)
+                except FileNotFoundError:
+                    suspects.append(file)
+                except OSError:
+                    pass
+                continue
 
-                    suspects.append(self.__valuables['files'][i])
+            if stats[file].st_atime != table.atime[i]:
+                suspects.append(self.__valuables['files'][i])
 
-            except FileExistsError:
-                continue
-            except PermissionError:
-                continue
+            #file is suspect whether its content changed or not, new hash is taken by baseline update
+            elif stats[file].st_mtime != table.mtime[i] or stats[file].st_size != table.size[i]:
+                suspects.append(self.__valuables['files'][i])
         
         return suspects
 
-    def __check_dirs(self, delay) -> list:
-        '''Checks valuable dirs'''
+    def __check_dirs(self) -> list:
+        '''Checks valuable dirs. Baseline atime already includes monitor own listing, so any atime move is foreign'''
         suspects = []
 
+        table = self.primary_stats['dirs']
         for i, dir in enumerate(self.__valuables['dirs']):
+            if not table.state[i]:
+                continue
+
             try:
-                if int(os.path.getatime(dir)-self.primary_stats['dirs'][i][0])!=delay:
+                st = os.stat(dir)
+                if st.st_atime != table.atime[i]:
                     suspects.append(self.__valuables['dirs'][i])
 
-                elif os.path.getmtime(dir) != self.primary_stats['dirs'][i][1]:
+                elif st.st_mtime != table.mtime[i]:
                     suspects.append(self.__valuables['dirs'][i])
                     
-            except FileExistsError:
+            except FileNotFoundError:
                 continue
             except PermissionError:
                 continue
@@ -154,6 +1367,80 @@ class LocalMonitor(LocalHandler):
         return suspects
 
 
+    def __check_trees(self) -> list:
+        '''Checks valuable trees, changes are localized to exact paths'''
+        suspects = []
+
+        for tree in self.__valuables['trees']:
+            new = MerkleTree(tree)
+            if tree in self.__trees:
+                suspects.extend(new.diff(self.__trees[tree]))
+            self.__trees[tree] = new
+
+        return suspects
+
+
+    def __scan_periodically(self) -> None:
+        while not self.__stop_threads.wait(self.fd_scan_interval):
+            self.__handle_suspects.extend(self.__scan_handles())
+
+    def __scan_handles(self) -> list:
+        '''Scans processes for open valuable files, found files are suspects'''
+        if 'files' not in self.primary_stats:
+            return []
+
+        table = self.primary_stats['files']
+        index = {(table.dev[i], table.ino[i]) : path for i, path in enumerate(table.paths) if table.state[i]}
+
+        suspects = []
+        for handle in self.__fd_scanner.scan(index):
+            self.__open_handles.append(handle)
+            if handle[0] not in suspects:
+                suspects.append(handle[0])
+        return suspects
+
+    def __row(self, table : StatsTable, path : str) -> dict | None:
+        '''Returns baseline stats of path'''
+        i = table.find(path)
+        if i < 0:
+            return None
+
+        row = dict(zip(('dev', 'ino', 'mtime_ns', 'size'), table.signature(i)), atime=table.atime[i], mtime=table.mtime[i])
+        if table.digest_size:
+            row['digest'] = table.digest(i).hex()
+        return row
+
+    def __stat_row(self, path : str) -> dict | None:
+        '''Returns current stats of path'''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return {'dev' : st.st_dev, 'ino' : st.st_ino, 'mtime_ns' : st.st_mtime_ns, 'size' : st.st_size,
+                'atime' : st.st_atime, 'mtime' : st.st_mtime}
+
+    def metrics(self) -> dict:
+        '''Returns watched and unavailable entries per category and hashed bytes for metrics endpoint'''
+        return {
+            'watched_entries' : {k : len(table) for k, table in self.primary_stats.items()},
+            'unavailable_entries' : {k : table.state.count(StatsTable.UNAVAILABLE) for k, table in self.primary_stats.items()},
+            'hashed_bytes_total' : self.__hash_pool.hashed_bytes
+        }
+
+    def details(self) -> dict[str, dict]:
+        '''Returns suspect : {'old' : stats, 'new' : stats} of last check. New stats have hash if baseline was updated by check'''
+        return self.__details
+
+    def open_handles(self):
+        '''Yields (path, pid, user, cmdline) of processes which opened valuable files since last call'''
+        while self.__open_handles:
+            yield self.__open_handles.popleft()
+
+    def log_records(self):
+        '''Yields (path, record) pairs appended to valuable logs since last call'''
+        while self.__log_records:
+            yield self.__log_records.popleft()
+
     def get_valuables(self) -> dict[str, list]:
         '''Returns current monitor valuables''' 
         return self.__valuables
@@ -161,7 +1448,19 @@ class LocalMonitor(LocalHandler):
     def set_valuables(self, new : dict[str, list]) -> None:
         '''Sets new valuables''' 
         self.__valuables = new
+        self.__group_files()
         self.reset_primary_stats()
+        self.__start_watchers()
+
+    def close(self) -> None:
+        '''Closes events watchers, hashing threads, open handles scanner and baseline saver. Changed baseline is saved'''
+        self.__stop_watchers()
+        self.__hash_pool.close()
+        self.__stop_threads.set()
+        if self.__scanner is not None:
+            self.__scanner.join()
+        self.__flush_baseline()
+        atexit.unregister(self.__flush_baseline)
 
     def get_config(self) -> str:
         '''Returns path to current config file'''
@@ -176,76 +1475,191 @@ class LocalMonitor(LocalHandler):
         return False
 
 
+    def __timed(self, phase : str):
+            '''Times phase if phases are collected'''
+            return nullcontext() if self.phases is None else self.phases.time(phase)
+
     def reset_primary_stats(self) -> None:
             '''Sets primary values of all valuables'''
-            for k in self.__valuables.keys():
-                self.primary_stats[k] = []
+            with self.__timed('reset_primary_stats'):
+                self.primary_stats.clear()
+                self.update_primary_stats()
+
+    def update_primary_stats(self, categories : list[str] | None = None) -> None:
+            '''Updates primary values of valuables, all categories by default. Only objects whose stat signature changed are re-hashed and re-listed'''
+            fresh = 0
+            categories = list(self.__valuables.keys()) if categories is None else categories
+            files_stats, digests = self.__hash_changed_files() if 'files' in categories else ({}, {})
+
+            for k in categories:
+                old = self.primary_stats.get(k, StatsTable(k, 0))
+                table = StatsTable(k, self.__digest_size(k))
+                fresh += old.paths != self.__valuables[k]
 
                 for obj in self.__valuables[k]:
                     try:
+                        st = files_stats[obj] if obj in files_stats else os.stat(obj)
+                        sig = self.__signature(st)
+                        j = old.find(obj)
+                        same = j >= 0 and old.signature(j) == sig
+                        fresh += not same
+
                         if k == 'dirs':
-                            pack = [os.path.getatime(obj),#ask time
-                                    os.path.getmtime(obj),#mod time
-                                    os.listdir(obj)]      #objects in dir
-                            self.primary_stats[k].append(pack)
+                            digest = old.digest(j) if same else self.__fingerprint(os.listdir(obj))
+                            if not same:#listing moves atime
+                                st = os.stat(obj)
+                            table.append(obj, sig, st.st_atime, st.st_mtime, digest=digest)
 
                         elif k == 'files':
-                            pack = [self.__calculate_hash(obj),#hash
-                                    os.path.getatime(obj),     #ask time
-                                    os.path.getmtime(obj),     #mod time
-                                    os.path.getsize(obj)]      #size
-                            self.primary_stats[k].append(pack)
+                            table.append(obj, sig, st.st_atime, st.st_mtime,
+                                         digest=bytes.fromhex(digests[obj]) if obj in digests else old.digest(j))
 
                         elif k == 'logs':
-                            pack = [
-                                len(os.listdir(obj))#files count
-                                ]
-                            self.primary_stats[k].append(pack)
+                            if obj not in self.__followers:
+                                self.__followers[obj] = LogFollower(obj)
+                            table.append(obj, sig, st.st_atime, st.st_mtime,
+                                         value=old.value[j] if same else len(os.listdir(obj)))
+
+                        elif k == 'trees':
+                            if obj not in self.__trees:
+                                self.__trees[obj] = MerkleTree(obj)
+                            fresh += same and old.digest(j) != self.__trees[obj].digest
+                            table.append(obj, sig, st.st_atime, st.st_mtime, digest=self.__trees[obj].digest)
+
+                        else:
+                            table.append_unavailable(obj)
                     
                     except (FileExistsError, PermissionError, OSError, FileNotFoundError):
-                        if k == 'files': self.primary_stats[k].append(self.UNAVAILABLE_FILE)
-                        else: self.primary_stats[k].append(0)
+                        table.append_unavailable(obj)
+
+                self.primary_stats[k] = table
+
+            if fresh:
+                self.__baseline_dirty = True
+
+            #drop events caused by reading valuables above
+            for watcher in self.__watchers:
+                watcher.read()
+
+    def baseline_memory(self) -> float:
+            '''Returns memory taken by primary stats per watched entry in bytes'''
+            entries = sum(map(len, self.primary_stats.values()))
+            if not entries:
+                return 0.0
+            return sum(table.memory() for table in self.primary_stats.values()) / entries
+
+    def check(self, delay : float = 1) -> dict[str : list]:
+            '''Checks valuables stats. Delay is real time passed since previous check, categories with own intervals are checked when due'''
+            due = self.__due_categories(delay)
+            old_tables = dict(self.primary_stats)
+            if self.__watchers:
+                suspects_map = self.__read_events(delay, due)
+            else:
+                suspects_map = self.__poll(delay, due)
+
+            while self.__handle_suspects:#files found open by scanner since last check
+                path = self.__handle_suspects.popleft()
+                if path not in suspects_map['files']:
+                    suspects_map['files'].append(path)
+
+            self.__details = {}
+            for k, suspects in suspects_map.items():
+                if k not in old_tables:
+                    continue
+                new = self.primary_stats[k]
+                for path in suspects:
+                    self.__details[path] = {'old' : self.__row(old_tables[k], path),
+                                            'new' : self.__row(new, path) if new is not old_tables[k] else self.__stat_row(path)}
+            return suspects_map
+
+    def wait(self, timeout : float) -> bool:
+            '''Sleeps until timeout, until kernel events are pending or until scanner found open valuable files.
+            Returns True if events or open files are pending'''
+            end = monotonic() + timeout
+            while not self.__handle_suspects:
+                left = end - monotonic()
+                if left <= 0:
+                    return False
+                step = min(left, self.fd_scan_interval) if self.__scanner is not None else left
+
+                if self.__watchers:
+                    if select(self.__watchers, [], [], step)[0]:
+                        return True
+                else:
+                    sleep(step)
+            return True
 
-    def check(self, delay : int = 1) -> dict[str : list]:
-            '''Checks valuables stats'''
+    def __poll(self, delay : float, due : list[str]) -> dict[str : list]:
+            '''Checks valuables stats by polling them'''
             options = {
                 'logs':self.__check_logs,
                 'files':self.__check_files,
-                'dirs':self.__check_dirs
+                'dirs':self.__check_dirs,
+                'trees':self.__check_trees
                 }
             
-            suspects_map = {}
+            suspects_map = {k : [] for k in self.__valuables.keys()}
 
-            for k in self.__valuables.keys():
-                if k == 'dirs':
-                    suspects_map[k] = options[k](delay)
-                    continue
-                suspects_map[k] = options[k]()
+            for k in due:
+                with self.__timed(f'check_{k}'):
+                    suspects_map[k] = options[k]()
 
-            self.reset_primary_stats()
+            with self.__timed('update_primary_stats'):
+                self.update_primary_stats(due)
 
             return suspects_map
 
 
 
 class LocalHoneypots(LocalHandler):
-    '''Honeypots manager for local machine'''
+    '''Honeypots manager for local machine. Argument registry_path sets file where placed honeypots are kept between restarts.
+    Argument place_workers sets amount of threads writing honeypots.
+    Arguments pool_size, content_sizes and seed set pregenerated contents pool: its size, range of contents sizes in bytes(e.g. 64-8192)
+    and random seed for reproducible honeypots, empty seed means random one.
+    Argument fd_scan_interval sets how often processes are scanned for open honeypots on Linux, 0 disables it.'''
     def __init__(self, names_path : str = './data/pretty_objects.json',
                  content_path : str = './data/pretty_contents.json',
                  gen_path : str = './data/gen_ex.txt',
-                 paths_path : str = './data/data.json'):
+                 paths_path : str = './data/data.json',
+                 registry_path : str = './data/honeypots.json',
+                 place_workers : int = 8,
+                 pool_size : int = 1024,
+                 content_sizes : str = '64-8192',
+                 seed : str = '',
+                 fd_scan_interval : float = 1.0):
         super().__init__()
         self.RANDOM_BORDER = 4096
+        self.place_workers : int = max(1, int(place_workers))
+        self.pool_size : int = max(1, int(pool_size))
+        self.random : Random = Random(seed if seed else None)
+        try:
+            low, high = map(int, content_sizes.split('-'))
+            self.content_sizes : tuple[int, int] = (min(low, high), max(low, high))
+        except ValueError:
+            print(f'invalid content sizes {content_sizes}, 64-8192 is used')
+            self.content_sizes = (64, 8192)
+        self.pool : ContentPool | None = None
+        self.__snapshots : dict[str, tuple] = {}#honeypot path : (dev, ino, atime_ns, mtime_ns, size)
+        self.__watcher : InotifyWatcher | None = None
+        self.__events : bool = os.path.exists('/proc/self')#kernel events are available
+        self.fd_scan_interval : float = float(fd_scan_interval)
+        self.__fd_scanner : FdScanner | None = FdScanner() if self.fd_scan_interval and os.path.isdir('/proc/self/fd') else None
+        self.__next_fd_scan : float = 0.0
+        self.__open_handles : deque = deque(maxlen=10000)#(path, pid, user, cmdline) of processes holding honeypots open
 
         self.pretty_names : list = []
         self.pretty_content : list = []
         self.pretty_paths : list = []
-        self.current_honeypots : list = []
+        self.current_honeypots : list = []#honeypots of last placement
+        self.registry : TrapRegistry = TrapRegistry(registry_path)
 
         self.set_paths(names_path,
                         content_path, 
                         paths_path, 
                         gen_path)
+        self.registry.prune()
+        self.registry.save()#sizes and mtimes of traps are taken again
+        self.__arm(list(self.registry.traps))
     
     def __set_pretty_objects(self) -> None:
         '''Parses .json file and gets pretty names'''
@@ -294,22 +1708,13 @@ class LocalHoneypots(LocalHandler):
     def __cache_gen_ex(self) -> None:
         '''Caches gen file'''
         with open(self.gen_path, 'r') as file:
-            self.gen_cache = file.read().split('\n')
+            self.gen_cache = [x for x in file.read().split('\n') if x]
 
-    def __make_fpasswd(self) -> str:
-        '''Generates fake password for beartrap'''
-        components = []
-
-        components.append(str(randint(0, self.RANDOM_BORDER)))
-        components.append(hex(randint(0, self.RANDOM_BORDER))[2:])
-        components.append(choice(self.gen_cache))
-        
-        shuffle(components)
-        return ''.join(components)
-    
-    def __insert_passwd(self, content : str) -> str:
-        '''Inserts pretty content into string'''
-        return content.replace('%password%', self.__make_fpasswd())
+    def __fill_pool(self) -> None:
+        '''Pregenerates honeypots contents'''
+        self.pool = ContentPool(self.pretty_content, self.gen_cache, self.random,
+                                self.pool_size, self.content_sizes, self.RANDOM_BORDER)
+        self.pool.fill()
 
 
     def set_paths(self, names_path : str = '',
@@ -327,6 +1732,7 @@ class LocalHoneypots(LocalHandler):
         self.__set_pretty_content()
         self.__set_pretty_paths()
         self.__cache_gen_ex()
+        self.__fill_pool()
 
     def get_paths(self) -> tuple:
         ''' Returns current config paths'''
@@ -336,32 +1742,174 @@ class LocalHoneypots(LocalHandler):
                 self.gen_path)
 
     def is_honeypot(self, path : str) -> bool:
-        '''Checks, if object placed in path is a honeypot'''
-        if path in self.current_honeypots:
-            return True
-        return False
+        '''Checks, if object placed in path is a honeypot. Renamed honeypot is watched again under new name'''
+        key = self.registry.find(path)
+        if key is not None and key not in self.__snapshots:
+            self.__arm([key])
+        return key is not None
+
+    def metrics(self) -> dict:
+        '''Returns amount of honeypots in place for metrics endpoint, registry also keeps moved and deleted ones'''
+        return {'placed' : len(self.__snapshots)}
+
+
+    def __unique_path(self, taken : set, free : set) -> str:
+        '''Picks pretty path which is not taken by existing object or by other honeypot of placement.
+        Normalized paths in free are traps in place, they are picked as if they did not exist'''
+        name = self.random.choice(self.pretty_names)
+        directory = self.random.choice(self.pretty_paths)
+        stem, ext = os.path.splitext(name)
+
+        full_path = os.path.join(directory, name)
+        n = 1
+        while full_path in taken or (os.path.lexists(full_path) and self.registry.normalize(full_path) not in free):
+            n += 1
+            full_path = os.path.join(directory, f'{stem}_{n}{ext}')
+
+        taken.add(full_path)
+        return full_path
+
+    def __write_honeypot(self, path : str, content : str) -> str:
+        '''Writes honeypot to temp file and moves it to path, existing object is never overwritten. Returns empty string on failure'''
+        directory, name = os.path.split(path)
+        tmp = os.path.join(directory, f'.{name}.{os.getpid()}.tmp')
 
+        try:
+            with open(tmp, 'w') as file:
+                file.write(content)
+
+            if os.name == 'nt':#rename does not overwrite on Windows
+                os.rename(tmp, path)
+            else:
+                try:
+                    os.link(tmp, path)
+                except FileExistsError:
+                    raise
+                except OSError:#file system without hard links
+                    if os.path.lexists(path):
+                        raise FileExistsError(path)
+                    os.rename(tmp, path)
+                else:
+                    os.unlink(tmp)
+
+        except OSError as e:
+            print(f'{e} - honeypot {path} cannot be placed')
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            return ''
 
-    def place_honeypots(self, monitor : LocalMonitor, amount : int = 3) -> list:
-        '''Places beartraps with pretty names and reutrns their paths'''
-        new_valuables = monitor.get_valuables()
-        out = []
+        return path
 
-        for _ in range(amount):
-            name = choice(self.pretty_names)
-            content = choice(self.pretty_content)
-            path = choice(self.pretty_paths)
+    def __snapshot(self, path : str) -> tuple | None:
+        '''Returns honeypot stats which are changed by any touch'''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_atime_ns, st.st_mtime_ns, st.st_size)
 
-            full_path = os.path.join(path, name)
+    def __arm(self, paths : list[str]) -> None:
+        '''Takes honeypots stats and adds honeypots to kernel events watcher'''
+        for path in paths:
+            snapshot = self.__snapshot(path)
+            if snapshot is not None:
+                self.__snapshots[path] = snapshot
 
-            with open(full_path, 'w') as file:
-                file.write(self.__insert_passwd(content))
-            
-            out.append(full_path)
-            new_valuables['files'].append(full_path)
-        
-        monitor.set_valuables(new_valuables)
-        monitor.reset_primary_stats()
+        if not self.__events:
+            return
+
+        try:
+            if self.__watcher is None:
+                self.__watcher = InotifyWatcher()
+            for path in paths:
+                if path in self.__snapshots:
+                    self.__watcher.add(path, 'files')
+
+        except (OSError, AttributeError) as e:
+            print(f'{e} - honeypots events are unavailable, only stats are checked')
+            if self.__watcher is not None:
+                self.__watcher.close()
+            self.__watcher = None
+            self.__events = False
+
+    def tripwire(self) -> list[str]:
+        '''Returns honeypots opened, changed, moved or deleted since previous call. Only honeypots stats, kernel events
+        and open handles of processes are checked'''
+        hits = []
+        if self.__watcher is not None:
+            for _, path in self.__watcher.read():
+                if path is not None and path not in hits:
+                    hits.append(path)
+            self.__watcher.lost.clear()#deleted and moved traps are found by stats below
+
+        changed = False
+        for path, snapshot in list(self.__snapshots.items()):
+            new = self.__snapshot(path)
+            if new == snapshot:
+                continue
+
+            changed = True
+            if new is not None and self.registry.verify(path):
+                self.__snapshots[path] = new
+            else:#moved trap is kept in registry until it is found by inode
+                del self.__snapshots[path]
+            if path not in hits:
+                hits.append(path)
+        if changed:
+            self.registry.save()
+
+        now = monotonic()
+        if self.__fd_scanner is not None and now >= self.__next_fd_scan:
+            self.__next_fd_scan = now + self.fd_scan_interval
+            #only traps in place are indexed, inode of deleted trap may be reused
+            index = {inode : key for inode, key in self.registry.inodes.items() if key in self.__snapshots}
+            for handle in self.__fd_scanner.scan(index):
+                self.__open_handles.append(handle)
+                if handle[0] not in hits:
+                    hits.append(handle[0])
+
+        return hits
+
+    def close(self) -> None:
+        '''Closes honeypots events watcher'''
+        if self.__watcher is not None:
+            self.__watcher.close()
+            self.__watcher = None
+
+    def open_handles(self):
+        '''Yields (path, pid, user, cmdline) of processes which opened honeypots since last call'''
+        while self.__open_handles:
+            yield self.__open_handles.popleft()
+
+    def place_honeypots(self, amount : int = 3) -> list:
+        '''Places beartraps with pretty unique names and returns their paths. Contents are copied from pool, honeypots are written concurrently.
+        Traps of previous runs which are still in place are reused and only missing ones are placed, so restart does not add traps.
+        Paths are picked as on first placement, so same seed places same honeypots.
+        Honeypots are not added to monitor valuables, they are watched by tripwire()'''
+        amount = int(amount)
+        self.registry.prune()
+        live = [key for key in self.registry.traps if os.path.lexists(key)]#moved and deleted traps are placed again
+        free = set(live)
+
+        taken = set()
+        picks = [self.__unique_path(taken, free) for _ in range(amount)]
+        reused = [path for path in picks if self.registry.normalize(path) in free]
+        paths = [path for path in picks if self.registry.normalize(path) not in free][:max(0, amount - len(live))]
+        jobs = zip(paths, self.pool.take(len(paths)))
+
+        with ThreadPoolExecutor(self.place_workers) as executor:
+            placed = [path for path in executor.map(lambda job: self.__write_honeypot(*job), jobs) if path]
+
+        if placed:
+            batch = self.registry.new_batch()
+            for path in placed:
+                self.registry.add(path, batch)
+        self.registry.save()
+        self.__arm([self.registry.normalize(path) for path in placed])
+
+        kept = set(map(self.registry.normalize, reused))
+        out = reused + placed
+        out += [path for path in live if path not in kept][:max(0, amount - len(out))]#traps of other seeds or amounts
         self.current_honeypots = out
 
         return out
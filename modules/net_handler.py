@@ -1,30 +1,458 @@
+import struct
+import asyncio
+import threading
+from json import load
+from datetime import datetime
+from collections import deque, OrderedDict
+from time import monotonic
+from random import Random
+
+try:
+    import resource
+except ImportError:#not unix
+    resource = None
+
+
+class DecoyEngine:
+    '''Asyncio listeners of decoy ports on background thread. Every connection attempt is recorded for check().
+    Flood is limited by token bucket and concurrent connections of every source, global connections limit,
+    bytes kept from every connection and idle timeout. Attempts over limits are aborted and counted per source'''
+    def __init__(self, max_connections : int = 1024, source_rate : float = 5.0, source_burst : int = 20,
+                 source_connections : int = 16, max_read : int = 2048, idle_timeout : float = 10.0,
+                 max_sources : int = 10000, max_records : int = 10000):
+        self.max_connections : int = int(max_connections)
+        self.source_rate : float = float(source_rate)
+        self.source_burst : int = int(source_burst)
+        self.source_connections : int = int(source_connections)
+        self.max_read : int = int(max_read)
+        self.idle_timeout : float = float(idle_timeout)
+        self.max_sources : int = int(max_sources)
+
+        self.listeners : dict[str, object] = {}#path : server or transport
+        self.sources : OrderedDict = OrderedDict()#source : [tokens, last refill, active connections], least recent first
+        self.active : int = 0
+        self.connections_total : dict[str, int] = {'tcp' : 0, 'udp' : 0}
+        self.limited_total : int = 0
+        self.dropped_total : int = 0#records dropped by full records queue
+
+        self.__records : deque = deque(maxlen=int(max_records))
+        self.__limited : dict[str, list] = {}#source : [aborted attempts, last path]
+        self.__lock : threading.Lock = threading.Lock()
+        self.pending : threading.Event = threading.Event()
+
+        self.loop : asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.thread : threading.Thread = threading.Thread(target=self.loop.run_forever, name='decoys', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def parse_ports(spec : str) -> list[tuple[str, int, str]]:
+        '''Parses PORT[-PORT][/udp][=service] items into (proto, port, service), service is empty if it is not set'''
+        out = []
+        for item in filter(None, map(str.strip, spec.split(','))):
+            try:
+                ports, _, service = item.partition('=')
+                ports, _, proto = ports.partition('/')
+                low, _, high = ports.partition('-')
+                proto = proto or 'tcp'
+                if proto not in ('tcp', 'udp'):
+                    raise ValueError
+                out.extend((proto, port, service.strip()) for port in range(int(low), int(high or low) + 1))
+            except ValueError:
+                print(f'invalid ports {item}, skipped')
+        return out
+
+    @staticmethod
+    def path(proto : str, host : str, port : int) -> str:
+        return f'{proto}://[{host}]:{port}' if ':' in host else f'{proto}://{host}:{port}'
+
+    def __raise_files_limit(self, needed : int) -> None:
+        '''Every listener and connection takes descriptor, soft limit is raised up to hard one'''
+        if resource is None:
+            return
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < needed:
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (needed if hard == resource.RLIM_INFINITY else min(needed, hard), hard))
+            except (ValueError, OSError) as e:
+                print(f'{e} - descriptors limit cannot be raised')
+
+    def bind(self, hosts : list[str], ports : list[tuple[str, int, str]]) -> list[str]:
+        '''Binds ports on every host and returns paths of new listeners. Busy ports are skipped'''
+        self.__raise_files_limit(len(self.listeners) + len(hosts) * len(ports) + self.max_connections + 64)
+        return asyncio.run_coroutine_threadsafe(self.__bind(hosts, ports), self.loop).result()
+
+    async def __bind(self, hosts : list[str], ports : list[tuple[str, int, str]]) -> list[str]:
+        jobs = [(host, *x) for host in hosts for x in ports if self.path(x[0], host, x[1]) not in self.listeners]
+        out = []
+        failed = 0
+        for i in range(0, len(jobs), 256):
+            results = await asyncio.gather(*(self.__listen(*job) for job in jobs[i:i + 256]), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    failed += 1
+                else:
+                    out.append(result)
+
+        if failed:
+            print(f'{failed} decoy ports cannot be bound(busy or privileged), skipped')
+        return out
+
+    async def __listen(self, host : str, proto : str, port : int, service : str) -> str:
+        if proto == 'udp':
+            listener, _ = await self.loop.create_datagram_endpoint(lambda: DatagramDecoy(self, host, port, service),
+                                                                   local_addr=(host, port))
+            port = listener.get_extra_info('sockname')[1]
+        else:
+            listener = await self.loop.create_server(lambda: DecoyProtocol(self, host, port, service), host, port, backlog=128)
+            port = listener.sockets[0].getsockname()[1]
+
+        path = self.path(proto, host, port)
+        self.listeners[path] = listener
+        return path
+
+    def admit(self, source : str, path : str, connection : bool = True) -> bool:
+        '''Takes token of source. Attempts over limits are counted and must be aborted. Called on loop thread'''
+        now = monotonic()
+        state = self.sources.get(source)
+        if state is None:
+            state = self.sources[source] = [float(self.source_burst), now, 0]
+            if len(self.sources) > self.max_sources:
+                self.sources.popitem(last=False)
+        else:
+            self.sources.move_to_end(source)
+            state[0] = min(self.source_burst, state[0] + (now - state[1]) * self.source_rate)
+            state[1] = now
+
+        if state[0] < 1 or (connection and (state[2] >= self.source_connections or self.active >= self.max_connections)):
+            self.limited_total += 1
+            with self.__lock:
+                if source in self.__limited or len(self.__limited) < self.max_sources:
+                    entry = self.__limited.setdefault(source, [0, path])
+                    entry[0] += 1
+                    entry[1] = path
+            self.pending.set()
+            return False
+
+        state[0] -= 1
+        if connection:
+            state[2] += 1
+            self.active += 1
+        return True
+
+    def release(self, source : str) -> None:
+        '''Frees connection slot of source'''
+        self.active -= 1
+        state = self.sources.get(source)
+        if state is not None and state[2]:
+            state[2] -= 1
+
+    def record(self, path : str, proto : str, service : str, peer : tuple, payload : bytes = b'') -> dict:
+        '''Records connection attempt, returned record gets payload while connection is open'''
+        record = {'time' : datetime.now(), 'path' : path, 'proto' : proto, 'service' : service,
+                  'source' : peer[0], 'source_port' : peer[1], 'payload' : payload, 'limited' : 0}
+        self.connections_total[proto] += 1
+        with self.__lock:
+            if len(self.__records) == self.__records.maxlen:
+                self.dropped_total += 1
+            self.__records.append(record)
+        self.pending.set()
+        return record
+
+    def drain(self) -> list[dict]:
+        '''Returns connection records since last call. Aborted attempts are summarized by one record per source'''
+        with self.__lock:
+            records = list(self.__records)
+            self.__records.clear()
+            limited, self.__limited = self.__limited, {}
+            self.pending.clear()
+
+        for source, (count, path) in limited.items():
+            records.append({'time' : datetime.now(), 'path' : path, 'proto' : path.split(':', 1)[0], 'service' : '',
+                            'source' : source, 'source_port' : 0, 'payload' : b'', 'limited' : count})
+        return records
+
+    def close(self) -> None:
+        '''Closes listeners, stops and closes loop'''
+        async def close_all():
+            for listener in self.listeners.values():
+                listener.close()
+            self.listeners.clear()
+
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(close_all(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        if not self.loop.is_closed():
+            self.loop.close()
+
+
+class DecoyProtocol(asyncio.Protocol):
+    '''Fake service of one TCP connection. It sends service banner, answers like real service refusing login
+    and keeps first bytes of client data'''
+    BANNERS : dict[str, bytes] = {
+        'ssh' : b'SSH-2.0-OpenSSH_8.9p1 Ubuntu-3ubuntu0.6\r\n',
+        'ftp' : b'220 (vsFTPd 3.0.5)\r\n',
+        'telnet' : b'Ubuntu 22.04.3 LTS\r\nlogin: '
+    }
+    HTTP_BODY : bytes = b'<html><head><title>401 Unauthorized</title></head><body><h1>Unauthorized</h1></body></html>\n'
+
+    def __init__(self, engine : DecoyEngine, host : str, port : int, service : str):
+        self.engine : DecoyEngine = engine
+        self.host : str = host
+        self.port : int = port
+        self.service : str = service
+        self.transport = None
+        self.source : str = ''
+        self.record : dict | None = None
+        self.buffer : bytearray = bytearray()
+        self.timer = None
+        self.password_asked : bool = False#telnet asks login and password in turn
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        peer = transport.get_extra_info('peername') or ('', 0)
+        path = self.engine.path('tcp', self.host, transport.get_extra_info('sockname')[1])
+        if not self.engine.admit(peer[0], path):
+            transport.abort()
+            return
+
+        self.source = peer[0]
+        self.record = self.engine.record(path, 'tcp', self.service, peer)
+        transport.set_write_buffer_limits(high=4096)
+        if self.service in self.BANNERS:
+            transport.write(self.BANNERS[self.service])
+        self.timer = self.engine.loop.call_later(self.engine.idle_timeout, transport.abort)
+
+    def data_received(self, data : bytes) -> None:
+        if self.record is None:
+            return
+
+        self.timer.cancel()
+        self.timer = self.engine.loop.call_later(self.engine.idle_timeout, self.transport.abort)
+        room = self.engine.max_read - len(self.buffer)
+        if room > 0:
+            self.buffer += data[:room]
+            self.record['payload'] = bytes(self.buffer)
+
+        replies = {
+            'ftp' : self.__ftp,
+            'telnet' : self.__telnet,
+            'http' : self.__http,
+            'smb' : self.__smb,
+            'redis' : self.__redis
+        }
+        if self.service in replies:
+            replies[self.service](data)
+        if len(self.buffer) >= self.engine.max_read:
+            self.transport.close()
+
+    def connection_lost(self, exc) -> None:
+        if self.record is None:
+            return
+        self.timer.cancel()
+        self.engine.release(self.source)
+
+    def __ftp(self, data : bytes) -> None:
+        for line in data.splitlines():
+            command = line.split(b' ', 1)[0].upper()
+            if command == b'USER':
+                self.transport.write(b'331 Please specify the password.\r\n')
+            elif command == b'PASS':
+                self.transport.write(b'530 Login incorrect.\r\n')
+            elif command == b'QUIT':
+                self.transport.write(b'221 Goodbye.\r\n')
+                self.transport.close()
+                return
+            else:
+                self.transport.write(b'530 Please login with USER and PASS.\r\n')
+
+    def __telnet(self, data : bytes) -> None:
+        if data.startswith(b'\xff'):#options negotiation
+            return
+        if self.password_asked:
+            self.transport.write(b'\r\nLogin incorrect\r\nlogin: ')
+        else:
+            self.transport.write(b'Password: ')
+        self.password_asked = not self.password_asked
+
+    def __http(self, data : bytes) -> None:
+        if b'\r\n\r\n' not in self.buffer and len(self.buffer) < self.engine.max_read:
+            return
+        self.transport.write(b'HTTP/1.1 401 Unauthorized\r\n'
+                             b'Server: Apache/2.4.52 (Ubuntu)\r\n'
+                             b'WWW-Authenticate: Basic realm="Restricted Content"\r\n'
+                             b'Content-Type: text/html\r\n'
+                             b'Content-Length: ' + str(len(self.HTTP_BODY)).encode() + b'\r\n'
+                             b'Connection: close\r\n\r\n' + self.HTTP_BODY)
+        self.transport.close()
+
+    def __smb(self, data : bytes) -> None:
+        '''Answers negotiate request with SMB2 access denied error over NetBIOS session'''
+        if len(self.buffer) < 8 or self.buffer[4:8] not in (b'\xffSMB', b'\xfeSMB'):
+            return
+        header = struct.pack('<4sHHIHHIIQIIQ16s', b'\xfeSMB', 64, 0, 0xC0000022, 0, 1, 1, 0, 0, 0, 0, 0, b'')
+        body = struct.pack('<HBBIB', 9, 0, 0, 0, 0)
+        self.transport.write(struct.pack('>I', len(header) + len(body)) + header + body)
+        self.transport.close()
+
+    def __redis(self, data : bytes) -> None:
+        self.transport.write(b'-NOAUTH Authentication required.\r\n' * max(1, data.count(b'\n')))
+
+
+class DatagramDecoy(asyncio.DatagramProtocol):
+    '''UDP decoy port. Datagrams are recorded, nothing is sent back, so decoy cannot be used for reflection'''
+    def __init__(self, engine : DecoyEngine, host : str, port : int, service : str):
+        self.engine : DecoyEngine = engine
+        self.host : str = host
+        self.port : int = port
+        self.service : str = service
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        self.port = transport.get_extra_info('sockname')[1]
+
+    def datagram_received(self, data : bytes, addr : tuple) -> None:
+        path = self.engine.path('udp', self.host, self.port)
+        if self.engine.admit(addr[0], path, connection=False):
+            self.engine.record(path, 'udp', self.service, addr, data[:self.engine.max_read])
+
 
 class NetMonitor:
-    '''Network monitor(ports, ping requests etc.)'''
-    def __init__(self):
-        pass
+    '''Network monitor, it records every connection attempt to decoy ports. Argument hosts sets comma separated addresses
+    where listeners are bound. Argument ports sets own listened ports of monitor, e.g. 8000-8010,5353/udp, they accept
+    connections silently. Honeypots bind more ports with fake services on the same listeners engine.
+    Arguments max_connections, source_rate, source_burst, source_connections, max_read and idle_timeout limit flood:
+    open connections at once, connection attempts per second of one source and its burst, open connections of one source,
+    bytes kept from connection and its idle time in seconds'''
+    def __init__(self, hosts : str = '127.0.0.1',
+                 ports : str = '',
+                 max_connections : int = 1024,
+                 source_rate : float = 5.0,
+                 source_burst : int = 20,
+                 source_connections : int = 16,
+                 max_read : int = 2048,
+                 idle_timeout : float = 10.0):
+        self.hosts : list[str] = [x.strip() for x in hosts.split(',') if x.strip()]
+        self.engine : DecoyEngine = DecoyEngine(max_connections, source_rate, source_burst, source_connections,
+                                                max_read, idle_timeout)
+        self.__details : dict[str, dict] = {}#suspect : last connection of last check
+        self.__open_handles : deque = deque(maxlen=10000)#(path, source, service, payload) of connections
+
+        self.ports : list[str] = self.engine.bind(self.hosts, DecoyEngine.parse_ports(ports))
+        print(f'listening on {len(self.ports)} ports')
+
+    def check(self, delay : float = 1) -> dict[str : list]:
+        '''Returns decoy ports touched since previous check. Connections are recorded by listeners, so delay is not used'''
+        suspects_map = {'tcp' : [], 'udp' : []}
+        self.__details = {}
+
+        for record in self.engine.drain():
+            path = record['path']
+            if path not in suspects_map[record['proto']]:
+                suspects_map[record['proto']].append(path)
+
+            payload = str(record['payload'])[2:-1]#escaped, so binary probes are printable
+            source = f'{record["source"]}:{record["source_port"]}' if not record['limited'] else record['source']
+            detail = self.__details.setdefault(path, {'connections' : 0, 'limited' : 0})
+            detail['connections'] += not record['limited']
+            detail['limited'] += record['limited']
+            detail.update(source=source, service=record['service'], payload=payload)
+            self.__open_handles.append((path, source, 'limited' if record['limited'] else record['service'] or 'raw',
+                                        payload if not record['limited'] else f'{record["limited"]} attempts aborted'))
+
+        return suspects_map
+
+    def wait(self, timeout : float) -> bool:
+        '''Sleeps until timeout or until connection is recorded. Returns True if connections are pending'''
+        return self.engine.pending.wait(timeout)
+
+    def details(self) -> dict[str, dict]:
+        '''Returns suspect : {'connections', 'limited', 'source', 'service', 'payload'} of last check, source and payload are of last connection'''
+        return self.__details
+
+    def open_handles(self):
+        '''Yields (path, source, service, payload) of connections since last call'''
+        while self.__open_handles:
+            yield self.__open_handles.popleft()
+
+    def metrics(self) -> dict:
+        '''Returns listeners and connections counters for metrics endpoint'''
+        return {
+            'listening_ports' : len(self.engine.listeners),
+            'active_connections' : self.engine.active,
+            'tracked_sources' : len(self.engine.sources),
+            'connections_total' : dict(self.engine.connections_total),
+            'limited_total' : self.engine.limited_total,
+            'dropped_total' : self.engine.dropped_total
+        }
+
+    def close(self) -> None:
+        self.engine.close()
+
 
 class NetHoneypots:
-    def __init__(self):
-        pass
-
-'''"bt_places" : [
-        "C:\\Users\\%username%\\Desktop\\",
-        "C:\\Users\\%username%\\Documents\\",
-        "C:\\Users\\%username%\\Downloads\\",
-        "C:\\",
-        "%userprofile%\\",
-        "%temp%\\",
-        "%appdata%\\",
-        "%appdata%\\Microsoft\\",
-        "%appdata%\\Discord\\",
-        "%local%\\Google\\",
-        "%local%\\Microsoft\\Credentials\\",
-        "C:\\Windows\\Temp\\",
-        "C:\\ProgramData\\",
-        "%public%",
-        "%userprofile%\\OneDrive\\Desktop\\",
-        "%userprofile%\\OneDrive\\Documents\\",
-        "C:\\Backup\\",
-        "C:\\Temp\\"
-    ]'''
\ No newline at end of file
+    '''Network honeypots: decoy ports with fake services(SSH, FTP, Telnet, HTTP, SMB, Redis) on monitor listeners.
+    Attractive ports are taken from net section of names file first, then from ports, e.g. 2222=ssh,2121=ftp,5353/udp,
+    then random free ports of port_range. Service is guessed by port if it is not set.
+    Same seed chooses same ports and services'''
+    SERVICES : dict[int, str] = {
+        21 : 'ftp', 2121 : 'ftp', 22 : 'ssh', 2222 : 'ssh', 23 : 'telnet', 2323 : 'telnet',
+        80 : 'http', 8000 : 'http', 8080 : 'http', 8888 : 'http', 139 : 'smb', 445 : 'smb', 4445 : 'smb', 6379 : 'redis'
+    }
+
+    def __init__(self, names_path : str = './data/pretty_objects.json',
+                 ports : str = '2222=ssh,2121=ftp,2323=telnet,8080=http,4445=smb',
+                 port_range : str = '20000-29999',
+                 seed : str = ''):
+        self.random : Random = Random(seed if seed else None)
+        self.ports : list[tuple[str, int, str]] = []
+        try:
+            with open(names_path, 'r') as file:
+                self.ports.extend(('tcp', int(port), '') for port in load(file)['net'])
+        except (OSError, KeyError, ValueError):
+            print(f'{names_path} has no net ports, they are skipped')
+        self.ports.extend(DecoyEngine.parse_ports(ports))
+        self.port_range : list[tuple[str, int, str]] = DecoyEngine.parse_ports(port_range)
+        self.current_honeypots : list[str] = []
+        self.__decoys : set[str] = set()
+
+    def __service(self, port : int) -> str:
+        return self.SERVICES.get(port) or self.random.choice(('ssh', 'ftp', 'telnet', 'http', 'smb'))
+
+    def is_honeypot(self, path : str) -> bool:
+        '''Checks, if port in path is a decoy'''
+        return path in self.__decoys
+
+    def metrics(self) -> dict:
+        '''Returns amount of decoy ports for metrics endpoint'''
+        return {'placed' : len(self.__decoys)}
+
+    def place_honeypots(self, monitor : NetMonitor, amount : int = 3) -> list:
+        '''Binds amount of decoy ports on every monitor host and returns their paths. Busy ports are replaced with ports of port range'''
+        amount = int(amount)
+        ordered = self.ports + self.random.sample(self.port_range, len(self.port_range))
+        services = {}
+        placed = []
+
+        for host in monitor.hosts:
+            candidates = deque(ordered)
+            taken = set()
+            bound = 0
+            while bound < amount and candidates:
+                batch = []
+                while candidates and len(batch) < amount - bound:
+                    proto, port, service = candidates.popleft()
+                    if (proto, port) not in taken:
+                        taken.add((proto, port))
+                        if (proto, port) not in services:#same port has same service on every host
+                            services[(proto, port)] = service or self.__service(port)
+                        batch.append((proto, port, services[(proto, port)]))
+
+                paths = monitor.engine.bind([host], batch)
+                bound += len(paths)
+                placed.extend(paths)
+
+        self.current_honeypots = placed
+        self.__decoys.update(placed)
+        return placed
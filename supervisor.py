@@ -0,0 +1,263 @@
+import argparse
+
+from collections import deque
+from statistics import median
+from time import sleep, monotonic, perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Queue
+from queue import Empty
+
+from event_sink import EventSink, JsonlSink
+from module_handler import Interface, ModuleHandler, IOHandler, Scheduler, SuspectTracker, read_params
+from start import read_config
+
+
+def run_isolated(mod_path : str, module : str, params_path : str, events : Queue) -> None:
+    '''Runs module in child process and sends its cycles to supervisor'''
+    mh = ModuleHandler(mod_path, module, headless=True)
+    inter = IOHandler(mh)
+    inter.start_headless(read_params(params_path))
+    scheduler = Scheduler(inter.delay, inter.overrun)
+
+    try:
+        while True:
+            started = perf_counter()
+            suspects_map = mh.monitor.check(scheduler.start())
+            latency = perf_counter() - started
+
+            detections = [(path, mh.honeypots.is_honeypot(path) if mh.honeypots else False)
+                          for suspects in suspects_map.values() for path in suspects]
+            events.put((module, latency, detections, inter.log_events()))
+
+            for hits in inter.watch_traps(scheduler.remaining()):
+                events.put((module, None, [(path, True) for path in hits], []))
+    except KeyboardInterrupt:#supervisor is stopping
+        return
+
+
+class ModuleWorker:
+    '''State of one supervised module'''
+    def __init__(self, module : str, params_path : str, isolated : bool = False, dedup_window : float = 60.0):
+        self.module : str = module
+        self.params_path : str = params_path
+        self.isolated : bool = isolated
+
+        self.inter : IOHandler | None = None
+        self.process : Process | None = None
+        self.future = None
+
+        self.scheduler : Scheduler | None = None
+        self.next_run : float = 0.0
+        self.next_tripwire : float = 0.0
+        self.cycles : int = 0
+        self.restarts : int = 0
+        self.latencies : deque = deque(maxlen=100)
+        self.tracker : SuspectTracker = SuspectTracker(dedup_window)
+
+
+class Supervisor(Interface):
+    '''Runs several modules in one process. Their checks are scheduled on shared thread pool, failed modules are restarted'''
+    def __init__(self, mod_path : str, workers : list[ModuleWorker], threads : int = 4,
+                 restart_delay : float = 5.0, report_interval : float = 60.0, sink : EventSink | None = None):
+        super().__init__(headless=True)
+
+        self.mod_path : str = mod_path
+        self.workers : list[ModuleWorker] = workers
+        self.restart_delay : float = restart_delay
+        self.report_interval : float = report_interval
+        self.sink : EventSink | None = sink
+
+        self.executor : ThreadPoolExecutor = ThreadPoolExecutor(threads)
+        self.events : Queue = Queue()#cycles of isolated modules
+
+    def start(self, worker : ModuleWorker) -> bool:
+        '''Starts module, failed module is scheduled for restart'''
+        self.print_action(f'Starting {worker.module}...')
+        try:
+            if worker.isolated:
+                worker.process = Process(target=run_isolated, daemon=True,
+                                         args=(self.mod_path, worker.module, worker.params_path, self.events))
+                worker.process.start()
+            else:
+                worker.inter = IOHandler(ModuleHandler(self.mod_path, worker.module, headless=True))
+                worker.inter.start_headless(read_params(worker.params_path))
+                worker.scheduler = Scheduler(worker.inter.delay, worker.inter.overrun)
+
+        except (Exception, SystemExit) as e:
+            self.fail(worker, e)
+            return False
+
+        worker.next_run = monotonic()
+        self.print_info(f'{worker.module} started')
+        return True
+
+    def fail(self, worker : ModuleWorker, error) -> None:
+        '''Drops failed module and schedules its restart'''
+        self.print_info(f'{worker.module} failed: {error!r}, restart in {self.restart_delay} s')
+        if worker.inter is not None:
+            self.close(worker)
+        worker.inter = None
+        worker.process = None
+        worker.future = None
+        worker.restarts += 1
+        worker.next_run = monotonic() + self.restart_delay
+
+    def close(self, worker : ModuleWorker) -> None:
+        '''Closes monitor and honeypots of module, so restarted module can take their ports, files and threads again.
+        They are closed by their optional close() methods after running check is finished'''
+        if worker.future is not None and not worker.future.cancel():
+            worker.future.exception()
+        mh = worker.inter.module_handler
+        for obj in (mh.monitor, mh.honeypots):
+            if obj is None or not hasattr(obj, 'close'):
+                continue
+            try:
+                obj.close()
+            except Exception as e:
+                self.print_info(f'{worker.module} cannot be closed: {e!r}')
+
+    def cycle(self, worker : ModuleWorker) -> tuple[dict, float, list[dict]]:
+        '''Runs one check of module, called in thread pool'''
+        started = perf_counter()
+        suspects_map = worker.inter.module_handler.monitor.check(worker.scheduler.start())
+        return suspects_map, perf_counter() - started, worker.inter.log_events()
+
+    def collect(self, worker : ModuleWorker) -> None:
+        '''Takes finished check of module'''
+        try:
+            suspects_map, latency, records = worker.future.result()
+        except Exception as e:
+            self.fail(worker, e)
+            return
+
+        honeypots = worker.inter.module_handler.honeypots
+        self.record(worker, latency, [(path, honeypots.is_honeypot(path) if honeypots else False)
+                                      for suspects in suspects_map.values() for path in suspects], records)
+
+        worker.future = None
+        worker.next_run = worker.scheduler.next_run
+
+    def record(self, worker : ModuleWorker, latency : float | None, detections : list[tuple], records : list[dict] | None = None) -> None:
+        '''Prints new and resolved detections of module and passes records of its logs to sink, latency is None for honeypots tripwire hits'''
+        if latency is not None:
+            worker.cycles += 1
+            worker.latencies.append(latency)
+
+        for path, record in worker.tracker.expire():
+            if record['count'] > 1:
+                self.emit(worker, path, record, 'resolved')
+        for path, is_honeypot in detections:
+            state, record = worker.tracker.hit(path, {'is_honeypot' : is_honeypot})
+            if state == 'new':
+                self.emit(worker, path, record, state)
+        if self.sink is not None and records:
+            for event in records:
+                self.sink.write({**event, 'module' : worker.module})
+
+    def emit(self, worker : ModuleWorker, path : str, record : dict, state : str) -> None:
+        date = record['first'] if state == 'new' else record['last']
+        print(f'{date}\t{worker.module}\t{path}\t{record["is_honeypot"]}\t{state}\t{record["count"]}', flush=True)
+        if self.sink is not None:
+            self.sink.write({'time' : date.isoformat(), 'module' : worker.module, 'path' : path, 'state' : state,
+                             'is_honeypot' : record['is_honeypot'], 'count' : record['count'],
+                             'first_seen' : record['first'].isoformat(), 'last_seen' : record['last'].isoformat()})
+
+    def tripwire(self, worker : ModuleWorker) -> None:
+        '''Checks honeypots of module between its checks'''
+        try:
+            hits = worker.inter.module_handler.honeypots.tripwire()
+        except Exception as e:
+            self.fail(worker, e)
+            return
+
+        self.record(worker, None, [(path, True) for path in hits])
+        worker.next_tripwire = monotonic() + worker.inter.tripwire_delay
+
+    def drain_events(self) -> None:
+        '''Takes cycles sent by isolated modules'''
+        workers = {w.module : w for w in self.workers if w.isolated}
+        while True:
+            try:
+                module, latency, detections, records = self.events.get_nowait()
+            except Empty:
+                return
+            self.record(workers[module], latency, detections, records)
+
+    def report(self) -> None:
+        '''Prints per-module cycles latency'''
+        for w in self.workers:
+            events, hits = w.tracker.rates()
+            if w.latencies:
+                self.print_info(f'{w.module}: {w.cycles} cycles, latency p50 {median(w.latencies) * 1000:.1f} ms, '
+                                f'max {max(w.latencies) * 1000:.1f} ms, {w.restarts} restarts, last minute {events} events, {hits} hits')
+            else:
+                self.print_info(f'{w.module}: no cycles yet, {w.restarts} restarts')
+
+    def run(self) -> None:
+        for worker in self.workers:
+            self.start(worker)
+
+        next_report = monotonic() + self.report_interval
+        try:
+            self.loop(next_report)
+        except KeyboardInterrupt:
+            self.report()
+            self.exit('Supervisor stopped')
+
+    def loop(self, next_report : float) -> None:
+        '''Schedules checks of modules and restarts failed ones'''
+        run = True
+        while run:
+            now = monotonic()
+
+            for w in self.workers:
+                if w.isolated:
+                    if w.process is not None and not w.process.is_alive():
+                        self.fail(w, f'exit code {w.process.exitcode}')
+                    elif w.process is None and now >= w.next_run:
+                        self.start(w)
+                    continue
+
+                if w.future is not None and w.future.done():
+                    self.collect(w)
+
+                if w.future is None and now >= w.next_run:
+                    if w.inter is None and not self.start(w):
+                        continue
+                    w.future = self.executor.submit(self.cycle, w)
+
+                if w.inter is not None and w.inter.has_tripwire() and now >= w.next_tripwire:
+                    self.tripwire(w)
+
+            self.drain_events()
+
+            if now >= next_report:
+                self.report()
+                next_report = now + self.report_interval
+
+            sleep(0.05)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mirage supervisor, runs several modules in one process')
+    parser.add_argument('modules', nargs='+', metavar='MODULE=PARAMS_FILE',
+                        help='module file name and its headless params file')
+    parser.add_argument('--threads', type=int, default=4, help='checks thread pool size')
+    parser.add_argument('--isolate', action='append', default=[], metavar='MODULE',
+                        help='run CPU-heavy module in its own process, can be repeated')
+    parser.add_argument('--restart-delay', type=float, default=5.0, help='seconds before failed module restart')
+    parser.add_argument('--report', type=float, default=60.0, help='latency report interval in seconds')
+    parser.add_argument('--events', default='', metavar='PATH', help='write detections of all modules to JSON Lines file')
+    parser.add_argument('--dedup-window', type=float, default=60.0,
+                        help='seconds without hits after which repeated detection is resolved')
+    args = parser.parse_args()
+
+    workers = []
+    for item in args.modules:
+        module, _, params_path = item.partition('=')
+        workers.append(ModuleWorker(module, params_path, module in args.isolate, args.dedup_window))
+
+    supervisor = Supervisor(read_config(), workers, args.threads, args.restart_delay, args.report,
+                            JsonlSink(args.events) if args.events else None)
+    supervisor.run()